@@ -16,6 +16,18 @@ app.conf.beat_schedule = {
         'schedule':
             crontab(hour=8, minute=0, day_of_week=1),  # понедельник 8:00
     },
+    'relay-outbox': {
+        'task': 'news.tasks.relay_outbox',
+        'schedule': 5.0,  # каждые 5 секунд
+    },
+    'prune-outbox': {
+        'task': 'news.tasks.prune_outbox',
+        'schedule': crontab(hour=3, minute=30),  # ежедневно 3:30
+    },
+    'flush-votes': {
+        'task': 'news.tasks.flush_votes',
+        'schedule': 10.0,  # каждые 10 секунд
+    },
 }
 
 
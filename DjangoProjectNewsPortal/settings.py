@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -58,6 +59,8 @@ INSTALLED_APPS += [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'news.query_budget.QueryBudgetMiddleware',
+    'news.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,6 +104,19 @@ DATABASES = {
     }
 }
 
+# реплики только для чтения, через запятую: пути к файлам для SQLite (локальная проверка на копии базы)
+# или host:port для PostgreSQL - имя базы и учётные данные те же, что у основной
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    if 'sqlite' in (DATABASES['default']['ENGINE'] or ''):
+        replica_settings = {'NAME': replica}
+    else:
+        host, _, port = replica.partition(':')
+        replica_settings = {'HOST': host, 'PORT': port}
+    # в тестах реплика - та же тестовая база, что и основная
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], **replica_settings, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['news.replicas.ReplicaRouter']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -117,12 +133,30 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+TESTING = sys.argv[1:2] == ['test']
+
 CACHES = {
+    # локальный LRU процесса перед общим кэшем: горячие страницы отдаются без обращения к диску и сети
     'default': {
+        'BACKEND': 'news.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000)),
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', 5)),
+        },
+    },
+    # общий уровень должен быть общим для всех процессов: веб-воркеры, celery и команды manage.py
+    # видят инвалидацию друг друга. Без Redis - файловый кэш, locmem только под manage.py test
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    } if TESTING else {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.path.join(BASE_DIR, 'cache_files'),
-
-    }
+    },
 }
 
 # Internationalization
@@ -164,6 +198,11 @@ EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "False").lower() in ("true", "1", "ye
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 ADMINS = os.getenv("ADMINS")
 SERVER_EMAIL = os.getenv("SERVER_EMAIL")
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "news.mail.PooledEmailBackend")
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", 2))
+EMAIL_RATE_LIMIT = float(os.getenv("EMAIL_RATE_LIMIT", 0))  # писем в секунду на процесс, 0 - без ограничения
+EMAIL_RATE_BURST = int(os.getenv("EMAIL_RATE_BURST", 10))
+EMAIL_SEND_RETRIES = int(os.getenv("EMAIL_SEND_RETRIES", 2))
 
 APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"
 APSCHEDULER_RUN_NOW_TIMEOUT = 25  # Seconds
@@ -186,3 +225,29 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+
+SITE_URL = os.getenv('SITE_URL', 'http://127.0.0.1:8000')
+NEWS_NOTIFICATION_BATCH_SIZE = int(os.getenv('NEWS_NOTIFICATION_BATCH_SIZE', 100))
+OUTBOX_RELAY_BATCH_SIZE = int(os.getenv('OUTBOX_RELAY_BATCH_SIZE', 500))
+OUTBOX_REDELIVERY_TIMEOUT = int(os.getenv('OUTBOX_REDELIVERY_TIMEOUT', 600))  # секунды
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))  # обработанные события старше этого удаляет задача prune_outbox
+NEWSLETTER_SHARD_SIZE = int(os.getenv('NEWSLETTER_SHARD_SIZE', 1000))
+NEWSLETTER_LOOKBACK_DAYS = int(os.getenv('NEWSLETTER_LOOKBACK_DAYS', 7))  # максимальная глубина рассылки для новых подписчиков
+NEWSLETTER_SHARD_MAX_ATTEMPTS = int(os.getenv('NEWSLETTER_SHARD_MAX_ATTEMPTS', 3))  # после стольких сбоев шард помечается ошибкой
+NEWSLETTER_RUN_RESUME_HOURS = int(os.getenv('NEWSLETTER_RUN_RESUME_HOURS', 24))  # незавершённая рассылка старше этого не продолжается
+CACHE_PAGE_TIMEOUT = int(os.getenv('CACHE_PAGE_TIMEOUT', 60 * 60 * 6))  # страницы инвалидируются по тегам, TTL - страховка
+CACHE_PAGE_STALE_TIMEOUT = int(os.getenv('CACHE_PAGE_STALE_TIMEOUT', 60 * 10))  # сколько отдавать устаревшую страницу, пока она пересчитывается
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', str(int(TESTING))) == '1'  # под manage.py test превышение бюджета запросов - ошибка
+PAGINATION_COUNT_TIMEOUT = int(os.getenv('PAGINATION_COUNT_TIMEOUT', 60 * 5))  # сколько кэшировать приблизительное число постов в ленте
+NEWS_SEARCH_BACKEND = os.getenv('NEWS_SEARCH_BACKEND', '')  # путь к классу news.search.SearchBackend; пусто - по типу базы
+VOTE_FLUSH_BATCH_SIZE = int(os.getenv('VOTE_FLUSH_BATCH_SIZE', 500))  # счётчиков голосов в одном UPDATE
+VOTE_FLUSH_LOCK_TIMEOUT = int(os.getenv('VOTE_FLUSH_LOCK_TIMEOUT', 60))  # секунды
+VOTE_DIRTY_TIMEOUT = int(os.getenv('VOTE_DIRTY_TIMEOUT', 60 * 60))  # через сколько объект, потерянный журналом, попадёт в него снова
+VOTE_JOURNAL_TIMEOUT = int(os.getenv('VOTE_JOURNAL_TIMEOUT', 60 * 60 * 24))
+POST_DAILY_LIMIT = int(os.getenv('POST_DAILY_LIMIT', 3))  # публикаций автора за скользящие сутки
+SUBSCRIPTION_RATE_LIMIT = int(os.getenv('SUBSCRIPTION_RATE_LIMIT', 20))  # подписок и отписок пользователя в минуту
+POST_RETENTION_DAYS = int(os.getenv('POST_RETENTION_DAYS', 365 * 2))  # посты старше этого срока переносит в архив manage.py archive_posts
+POST_ARCHIVE_DIR = os.getenv('POST_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))  # секунды; реплика, отставшая сильнее, не используется
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 1))  # как часто процесс перемеряет отставание
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 10))  # сколько клиент после записи читает основную базу
@@ -2,6 +2,3 @@ from django.apps import AppConfig
 
 class AppointmentConfig(AppConfig):
     name = 'appointment'
-
-    def ready(self):
-        import appointment.signals
\ No newline at end of file
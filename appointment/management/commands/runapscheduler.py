@@ -1,53 +1,15 @@
 from django.core.management.base import BaseCommand
 from apscheduler.schedulers.blocking import BlockingScheduler
-from django.utils import timezone
 
-from news.models import Post, Category
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from news.digest import send_weekly_digest
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
 def send_weekly_posts():
-    today = timezone.now()
-    last_week = today - timezone.timedelta(days=7)
-    categories = Category.objects.all()
-    site_url = 'http://127.0.0.1:8000'
-
-
-    for category in categories:
-        posts = Post.objects.filter(category=category, timestamp__gte=last_week)
-        if not posts.exists():
-            continue
-
-        subscribers = category.subscribers.all()
-        for user in subscribers:
-            if not user.email:
-                continue
-
-            html_content = render_to_string(
-                'news/weekly_newsletter.html',
-                {
-                    'category': category,
-                    'posts': posts,
-                    'username': user.username,
-                    'site_url': site_url,
-                }
-            )
-
-            subject = f'Новые статьи в категории "{category.name}" за неделю'
-            from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', settings.EMAIL_HOST_USER)
-
-            msg = EmailMultiAlternatives(
-                subject=subject,
-                body=f'Здравствуйте, {user.username}. Посмотрите новые статьи за неделю.',
-                from_email=from_email,
-                to=[user.email],
-            )
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
+    sent = send_weekly_digest()
+    logger.info("Еженедельная рассылка: отправлено писем %s", sent)
 
 class Command(BaseCommand):
     help = "Запускает APScheduler для еженедельной рассылки"
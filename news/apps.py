@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.core.cache import cache
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+from .search import get_search_backend
+
+
+def repair_search_index(sender, using, **kwargs):
+    # миграции, пересоздающие news_post, теряют триггеры поискового индекса
+    connection = connections[using]
+    get_search_backend(connection).repair(connection)
 
 
 class NewsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'news'
+
+    def ready(self):
+        import news.signals
+        post_migrate.connect(repair_search_index, sender=self)
+        if hasattr(cache, 'start_listening'):
+            cache.start_listening()
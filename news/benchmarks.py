@@ -0,0 +1,132 @@
+import resource
+import socketserver
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from .models import Author, Category, Post, PostCategory
+
+User = get_user_model()
+
+# бенчмарки считают свою работу, а не Redis или файловый кэш: оба уровня кэша в памяти процесса
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+@contextmanager
+def isolated_database():
+    # бенчмарки работают на отдельной тестовой базе, рабочие данные не трогаются
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed(categories, subscribers, posts, batch_size=5000, keep_posts=True, content='Текст новости. ' * 50):
+    author_user = User.objects.create(username='bench_author', email='author@bench.local')
+    author = Author.objects.create(user=author_user)
+
+    category_objs = Category.objects.bulk_create(
+        [Category(name=f'Категория {i}') for i in range(categories)]
+    )
+    users = User.objects.bulk_create(
+        [User(username=f'bench{i}', email=f'bench{i}@bench.local') for i in range(subscribers)],
+        batch_size=batch_size,
+    )
+    # каждый подписчик подписан на две соседние категории
+    Category.subscribers.through.objects.bulk_create(
+        [
+            Category.subscribers.through(category_id=category_objs[(i + shift) % categories].pk, user_id=user.pk)
+            for i, user in enumerate(users)
+            for shift in {0, 1 % categories}
+        ],
+        batch_size=batch_size,
+    )
+    # посты вставляются пачками, чтобы миллион объектов не держать в памяти одновременно
+    post_objs = []
+    for start in range(0, posts, batch_size):
+        chunk = Post.objects.bulk_create(
+            [
+                Post(author=author, title=f'Новость {i}', content=content(i) if callable(content) else content)
+                for i in range(start, min(start + batch_size, posts))
+            ]
+        )
+        PostCategory.objects.bulk_create(
+            [PostCategory(post=post, category=category_objs[i % categories]) for i, post in enumerate(chunk, start)]
+        )
+        if keep_posts:
+            post_objs.extend(chunk)
+    return post_objs
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Timer:
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def wrap(self, func):
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.elapsed += perf_counter() - started
+        return wrapper
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 bench SMTP sink')
+        while line := self.rfile.readline():
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250-bench')
+                self.reply('250 8BITMIME')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.sink.received()
+                self.reply('250 OK')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPSink:
+    # минимальный SMTP-сервер в том же процессе: принимает письма и только считает их
+    def __init__(self, host='127.0.0.1'):
+        self.server = socketserver.ThreadingTCPServer((host, 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.host, self.port = self.server.server_address
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def received(self):
+        with self.lock:
+            self.count += 1
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
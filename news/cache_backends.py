@@ -0,0 +1,286 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+STATS_KEY_PREFIX = 'cache-stats:'
+
+# Django создаёт свой экземпляр кэша в каждом потоке, а локальный уровень и подписка на инвалидацию
+# должны быть одни на процесс: иначе удалённая копия остаётся в LRU соседних потоков
+_process_locals = {}
+_process_buses = {}
+_process_lock = threading.Lock()
+
+
+class LocalLRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return _MISSING
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class RedisInvalidationBus:
+    # рассылает ключи, удалённые из локального уровня, остальным процессам через Redis pub/sub
+    def __init__(self, client, channel, callback):
+        self.client = client
+        self.channel = channel
+        self.callback = callback
+        self.sender = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ensure_listening(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # после fork у процесса свой отправитель, иначе он пропускал бы сообщения родителя и соседей
+            self.sender = uuid4().hex
+            self.pid = os.getpid()
+            threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    sender, keys = pickle.loads(message['data'])
+                    if sender != self.sender:
+                        self.callback(keys)
+            except Exception:
+                logger.exception("Подписка на инвалидацию кэша прервана, переподключение")
+                time.sleep(1)
+
+    def publish(self, keys):
+        self.ensure_listening()
+        self.client.publish(self.channel, pickle.dumps((self.sender, keys)))
+
+
+class TieredCache(BaseCache):
+    """
+    Двухуровневый кэш: ограниченный LRU в памяти процесса с коротким TTL перед общим бэкендом
+    (OPTIONS['SHARED'] - алиас из CACHES: locmem в тестах, Redis в продакшене, файлы без Redis).
+    Записи и удаления рассылают инвалидацию локальных копий в другие процессы, если общий бэкенд - Redis;
+    с другим бэкендом чужая копия живёт не дольше LOCAL_TIMEOUT.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.channel = options.get('INVALIDATION_CHANNEL', 'cache-invalidation')
+        self.stats_flush_every = options.get('STATS_FLUSH_EVERY', 1000)
+        with _process_lock:
+            self.local = _process_locals.setdefault(self.channel, LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1000)))
+        self.stats = Counter()
+        self.pending_stats = Counter()
+        self.stats_lock = threading.Lock()
+
+    @cached_property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    @cached_property
+    def bus(self):
+        client = getattr(self.shared, '_cache', None)
+        if client is None or not hasattr(client, 'get_client'):
+            return None
+        with _process_lock:
+            if self.channel not in _process_buses:
+                _process_buses[self.channel] = RedisInvalidationBus(
+                    client.get_client(write=True), self.channel, self.evict,
+                )
+            return _process_buses[self.channel]
+
+    def start_listening(self):
+        # подписка нужна с запуска процесса: процесс, который сам не пишет, тоже должен узнавать о чужих записях
+        if self.bus is not None:
+            self.bus.ensure_listening()
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] += 1
+            self.pending_stats[name] += 1
+            if sum(self.pending_stats.values()) < self.stats_flush_every:
+                return
+            pending, self.pending_stats = self.pending_stats, Counter()
+        # счётчики всех процессов суммируются в общем кэше, их показывает manage.py cache_stats
+        for name, delta in pending.items():
+            incr_counter(self.shared, name, delta)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def evict(self, keys):
+        if keys is None:
+            self.local.clear()
+            return
+        for key in keys:
+            self.local.delete(key)
+
+    def invalidate(self, keys):
+        self.evict(keys)
+        if self.bus is not None:
+            try:
+                self.bus.publish(keys)
+            except Exception:
+                logger.exception("Не удалось разослать инвалидацию кэша")
+
+    def store_local(self, local_key, value, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            ttl = self.local_timeout
+        else:
+            ttl = min(timeout, self.local_timeout)
+        if ttl > 0:
+            self.local.set(local_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+
+    def get(self, key, default=None, version=None):
+        self.start_listening()
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            self.count('local_hits')
+            return pickle.loads(value)
+        self.count('local_misses')
+
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.count('shared_misses')
+            return default
+        self.count('shared_hits')
+        self.store_local(local_key, value, None)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.start_listening()
+        result = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                self.count('local_misses')
+                missing.append(key)
+            else:
+                self.count('local_hits')
+                result[key] = pickle.loads(value)
+
+        if missing:
+            found = self.shared.get_many(missing, version=version)
+            for key in missing:
+                if key in found:
+                    self.count('shared_hits')
+                    self.store_local(self.make_and_validate_key(key, version=version), found[key], None)
+                else:
+                    self.count('shared_misses')
+            result.update(found)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.shared.set(key, value, timeout, version=version)
+        self.invalidate([local_key])
+        self.store_local(local_key, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        local_keys = {key: self.make_and_validate_key(key, version=version) for key in data}
+        self.invalidate(list(local_keys.values()))
+        for key, value in data.items():
+            if key not in failed:
+                self.store_local(local_keys[key], value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.invalidate([self.make_and_validate_key(key, version=version)])
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        deleted = self.shared.delete(key, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def incr(self, key, delta=1, version=None):
+        # атомарность обеспечивает общий бэкенд
+        value = self.shared.incr(key, delta, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.shared.clear()
+        self.invalidate(None)
+
+
+def shared_cache(cache=None):
+    # счётчики, блокировки и журналы пишутся в общий уровень напрямую, без рассылки инвалидации локальных копий
+    cache = caches['default'] if cache is None else cache
+    return getattr(cache, 'shared', cache)
+
+
+def has_atomic_counters(cache):
+    # add и incr атомарны для всех процессов только в Redis; locmem бывает только в тестах, где процесс один.
+    # Файловый кэш читает и записывает счётчик отдельными операциями, одновременные прибавления теряются
+    return isinstance(cache, (RedisCache, LocMemCache))
+
+
+def incr_counter(cache, name, delta=1):
+    key = f'{STATS_KEY_PREFIX}{name}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, None)
@@ -0,0 +1,227 @@
+import math
+import random
+import time
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.cache import CacheMiddleware
+from django.utils.cache import get_cache_key, patch_cache_control
+from django.utils.decorators import decorator_from_middleware_with_args
+from django.utils.http import http_date
+
+from .cache_backends import incr_counter, shared_cache
+
+TAG_KEY_PREFIX = 'cache-tag:'
+LOCK_KEY_PREFIX = 'cache-lock:'
+LAST_BUMP_KEY = 'cache-tag-last-bump'
+
+
+def tag_key(tag):
+    return f'{TAG_KEY_PREFIX}{tag}'
+
+
+def initial_version():
+    # если ключ тега вытеснен из кэша, новая версия не совпадёт ни с одной сохранённой
+    return int(time.time() * 1000)
+
+
+def get_tag_versions(tags):
+    found = cache.get_many([tag_key(tag) for tag in tags])
+    versions = {}
+    for tag in tags:
+        version = found.get(tag_key(tag))
+        if version is None:
+            version = initial_version()
+            if not cache.add(tag_key(tag), version, None):
+                version = cache.get(tag_key(tag), version)
+        versions[tag] = version
+    return versions
+
+
+def bump_tags(*tags):
+    for tag in set(tags):
+        try:
+            cache.incr(tag_key(tag))
+        except ValueError:
+            cache.add(tag_key(tag), initial_version(), None)
+    if tags:
+        # по времени последней инвалидации кэш решает, могла ли страница с реплики пропустить изменения
+        shared_cache().set(LAST_BUMP_KEY, time.time(), None)
+
+
+def last_bump():
+    # отметка вытеснена из кэша: считается, что сброс был только что
+    now = time.time()
+    if shared_cache().add(LAST_BUMP_KEY, now, None):
+        return now
+    return shared_cache().get(LAST_BUMP_KEY, now)
+
+
+def add_cache_tags(request, *tags):
+    # версии фиксируются в момент добавления тега, до того как страница прочитает данные
+    versions = getattr(request, '_cache_tag_versions', None)
+    if versions is None:
+        versions = request._cache_tag_versions = {}
+    new_tags = [tag for tag in tags if tag not in versions]
+    if new_tags:
+        versions.update(get_tag_versions(new_tags))
+
+
+def related_tags(post):
+    # рядом с постом выводятся имя автора и названия категорий: их переименование тоже меняет страницу
+    return [f'author-{post.author_id}', *(f'category-{category.pk}' for category in post.category.all())]
+
+
+def tag_posts(request, posts):
+    # версии тегов поста, его автора и категорий - ключ кэша строки в news/post_row.html,
+    # одной на все списки, поиск и категории
+    tags = {post.pk: [f'post-{post.pk}', *related_tags(post)] for post in posts}
+    add_cache_tags(request, *(tag for row_tags in tags.values() for tag in row_tags))
+    versions = request._cache_tag_versions
+    for post in posts:
+        post.cache_version = '.'.join(str(versions[tag]) for tag in tags[post.pk])
+
+
+class TaggedCacheMiddleware(CacheMiddleware):
+    # cache_page, у которого закэшированный ответ помнит версии тегов, от которых он зависит.
+    # Устаревшая запись (по тегам или по сроку) пересчитывается одним процессом под блокировкой в кэше,
+    # остальные в это время получают старую версию (stale-while-revalidate)
+    def __init__(self, get_response, browser_timeout=None, stale_timeout=None, lock_timeout=30,
+                 wait_timeout=5, poll_interval=0.05, beta=1.0, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.browser_timeout = browser_timeout
+        self.fresh_timeout = self.page_timeout
+        self.stale_timeout = settings.CACHE_PAGE_STALE_TIMEOUT if stale_timeout is None else stale_timeout
+        # запись хранится дольше срока свежести, чтобы её было что отдавать во время пересчёта
+        self.page_timeout = self.fresh_timeout + self.stale_timeout
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.beta = beta
+
+    def process_request(self, request):
+        if not is_cacheable(request):
+            request._cache_update_cache = False
+            return None
+        request._cache_started = time.monotonic()
+        response = super().process_request(request)
+        if response is None:
+            if getattr(request, '_cache_update_cache', False):
+                return self.wait_for_recompute(request)
+            return None
+
+        if not self.needs_refresh(response):
+            return self.limit_browser_cache(response)
+        if self.acquire_lock(request):
+            request._cache_update_cache = True
+            return None
+        count_page_event(self.cache, 'page_stale_served')
+        response.cache_stale = True
+        return self.limit_browser_cache(response)
+
+    def process_response(self, request, response):
+        if not is_cacheable(request):
+            return response
+        versions = getattr(request, '_cache_tag_versions', None)
+        if versions:
+            response.cache_tag_versions = versions
+        response.cache_compute_time = time.monotonic() - getattr(request, '_cache_started', time.monotonic())
+        response.cache_fresh_until = time.time() + self.page_fresh_timeout(request, response.cache_compute_time)
+        try:
+            response = super().process_response(request, response)
+        finally:
+            self.release_lock(request)
+        return self.limit_browser_cache(response)
+
+    def process_exception(self, request, exception):
+        self.release_lock(request)
+        return None
+
+    def page_fresh_timeout(self, request, compute_time):
+        # страница прочитана с реплики, а теги сбрасывались в пределах её отставания: данные могли не дойти
+        # до реплики, хотя версия тегов уже новая. Такая запись живёт не дольше отставания и пересчитывается
+        lag = getattr(request, '_replica_lag', None)
+        if lag is not None and last_bump() >= time.time() - compute_time - lag:
+            return min(self.fresh_timeout, lag)
+        return self.fresh_timeout
+
+    def needs_refresh(self, response):
+        versions = getattr(response, 'cache_tag_versions', None)
+        if versions and get_tag_versions(list(versions)) != versions:
+            return True
+        # XFetch: чем дольше считалась страница и чем ближе конец срока, тем вероятнее обновить её заранее,
+        # чтобы запись не истекала одновременно у всех
+        fresh_until = getattr(response, 'cache_fresh_until', 0)
+        compute_time = getattr(response, 'cache_compute_time', 0)
+        return time.time() - compute_time * self.beta * math.log(1 - random.random()) >= fresh_until
+
+    def wait_for_recompute(self, request):
+        # холодный промах: страницу считает тот, кто взял блокировку, остальные недолго ждут результат
+        if self.acquire_lock(request):
+            return None
+        lock_key = self.lock_key(request)
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            response = super().process_request(request)
+            if response is not None:
+                count_page_event(self.cache, 'page_coalesced')
+                return self.limit_browser_cache(response)
+            # блокировку сняли, а страницы нет: ответ не кэшируется (404, редирект) или считавший упал
+            if not shared_cache(self.cache).has_key(lock_key):
+                break
+        # пересчёт под блокировкой, если её удастся взять; иначе без неё, чтобы не ждать дольше
+        self.acquire_lock(request)
+        request._cache_update_cache = True
+        return None
+
+    def lock_key(self, request):
+        cache_key = get_cache_key(request, self.key_prefix, 'GET', cache=self.cache)
+        if cache_key is None:
+            cache_key = request.build_absolute_uri()
+        return f'{LOCK_KEY_PREFIX}{md5(cache_key.encode(), usedforsecurity=False).hexdigest()}'
+
+    def acquire_lock(self, request):
+        key = self.lock_key(request)
+        if not self.cache.add(key, 1, self.lock_timeout):
+            return False
+        request._cache_lock_key = key
+        count_page_event(self.cache, 'page_recomputes')
+        return True
+
+    def release_lock(self, request):
+        key = getattr(request, '_cache_lock_key', None)
+        if key is not None:
+            del request._cache_lock_key
+            self.cache.delete(key)
+
+    def limit_browser_cache(self, response):
+        # браузер не знает о тегах, поэтому ему отдаётся короткий max-age вместо TTL серверного кэша
+        if response.has_header('Expires'):
+            max_age = self.fresh_timeout if self.browser_timeout is None else self.browser_timeout
+            response.headers.pop('Age', None)
+            response.headers['Expires'] = http_date(time.time() + max_age)
+            patch_cache_control(response, max_age=max_age)
+        return response
+
+
+def is_cacheable(request):
+    # в шапке страницы имя пользователя, CSRF-токен и кнопка выхода, а Vary: Cookie сессия добавляет
+    # уже после сохранения страницы в кэш - поэтому кэшируются только ответы анонимам
+    user = getattr(request, 'user', None)
+    return user is None or not user.is_authenticated
+
+
+def count_page_event(cache, name):
+    incr_counter(shared_cache(cache), name)
+
+
+def tagged_cache_page(timeout, *, cache=None, key_prefix=None, browser_timeout=60, stale_timeout=None):
+    return decorator_from_middleware_with_args(TaggedCacheMiddleware)(
+        page_timeout=timeout,
+        cache_alias=cache,
+        key_prefix=key_prefix,
+        browser_timeout=browser_timeout,
+        stale_timeout=stale_timeout,
+    )
@@ -0,0 +1,97 @@
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .caching import get_tag_versions
+from .filters import NewsFilter
+from .models import Post
+
+_MISSING = object()
+
+
+def conditional_page(get_validators):
+    """
+    Отвечает 304 Not Modified по ETag/Last-Modified, которые get_validators(request, *args, **kwargs)
+    считает без рендеринга. Ставится снаружи tagged_cache_page: совпавший валидатор не доходит даже до кэша.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            etag, last_modified = get_validators(request, *args, **kwargs)
+            if etag is not None:
+                # в шапке страницы имя пользователя и CSRF-токен, поэтому валидатор свой у каждого пользователя
+                raw = f'{request.user.pk}:{etag}'
+                etag = quote_etag(md5(raw.encode(), usedforsecurity=False).hexdigest())
+            if last_modified is not None and not request.user.is_authenticated:
+                last_modified = int(last_modified.timestamp())
+            else:
+                # вход и выход меняют страницу, не меняя данных, поэтому If-Modified-Since только для анонимов
+                last_modified = None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+
+            # закэшированная страница хранит заголовки своего первого ответа, поэтому они выставляются заново;
+            # устаревшая копия из кэша не должна закрепиться у клиента под валидатором новой версии
+            response.headers.pop('ETag', None)
+            response.headers.pop('Last-Modified', None)
+            if response.status_code in (200, 304) and not getattr(response, 'cache_stale', False):
+                if etag is not None:
+                    response.headers['ETag'] = etag
+                if last_modified is not None:
+                    response.headers['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def tags_version_key(*tags):
+    versions = get_tag_versions(list(tags))
+    return ':'.join(str(versions[tag]) for tag in sorted(versions))
+
+
+def aggregate_validators(queryset, *tags):
+    # агрегат по всей выборке на большом архиве - полный проход по таблице, поэтому он кэшируется
+    # до следующей смены версий тегов: любое изменение постов поднимает тег 'posts'
+    version_key = tags_version_key('posts', *tags)
+    key = f'validators:{md5(f"{version_key}:{queryset.query}".encode(), usedforsecurity=False).hexdigest()}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = queryset.aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        cache.set(key, stats, settings.CACHE_PAGE_TIMEOUT)
+    return f"{version_key}:{stats['last_modified']}:{stats['count']}", stats['last_modified']
+
+
+def post_validators(request, pk):
+    # запрос к базе - только после смены версии тега поста; имя автора и названия категорий
+    # на странице поста меняют общие теги 'authors' и 'categories'
+    version_key = tags_version_key(f'post-{pk}', 'authors', 'categories')
+    key = f'validators:post-{pk}:{version_key}'
+    updated_at = cache.get(key, _MISSING)
+    if updated_at is _MISSING:
+        updated_at = Post.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        cache.set(key, updated_at, settings.CACHE_PAGE_TIMEOUT)
+    if updated_at is None:
+        return None, None
+    return f'{pk}:{version_key}:{updated_at}', updated_at
+
+
+def post_list_validators(request):
+    # в строках списка имена авторов и названия категорий: их переименование тоже меняет страницу
+    return aggregate_validators(NewsFilter(request.GET, Post.objects.all()).qs, 'authors', 'categories')
+
+
+def category_validators(request, category_id):
+    # версия тега категории меняется при переименовании и при подписке/отписке (кнопка на странице)
+    return aggregate_validators(
+        Post.objects.filter(category__id=category_id), f'category-{category_id}', 'authors', 'categories',
+    )
@@ -0,0 +1,113 @@
+import logging
+import smtplib
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Category, NewsletterWatermark, Post
+from .notifications import PreparedNotification, chunked, get_batch_size
+
+logger = logging.getLogger(__name__)
+
+
+def get_digest_pairs(since, until=None, user_range=None):
+    # условия на посты собираются в один filter(): на каждый отдельный filter() по обратной связи
+    # Django строит свой JOIN, и условия перестают относиться к одному и тому же посту.
+    # Пользователю уходят только посты новее его водяной отметки (range scan по timestamp)
+    conditions = Q(category__category_posts__post__timestamp__gte=since) & (
+        Q(user__newsletter_watermark__isnull=True)
+        | Q(category__category_posts__post__timestamp__gt=F('user__newsletter_watermark__delivered_until'))
+    )
+    if until is not None:
+        conditions &= Q(category__category_posts__post__timestamp__lt=until)
+    if user_range is not None:
+        conditions &= Q(user_id__gte=user_range[0], user_id__lte=user_range[1])
+
+    return Category.subscribers.through.objects.filter(conditions).exclude(user__email='')
+
+
+def iter_digests(since, until=None, user_range=None):
+    # пары (подписчик, пост) по всем категориям одним запросом, отсортированные по пользователю:
+    # итератор отдаёт по одному пользователю с его постами без загрузки всей выборки в память
+    pairs = get_digest_pairs(since, until, user_range)
+
+    pairs = pairs.values_list(
+        'user_id', 'user__username', 'user__email', 'category__category_posts__post_id',
+    ).distinct().order_by('user_id', '-category__category_posts__post_id')
+
+    for (user_id, username, email), rows in groupby(pairs.iterator(), key=itemgetter(0, 1, 2)):
+        yield user_id, username, email, [row[3] for row in rows]
+
+
+def prepare_digest(posts):
+    return PreparedNotification(
+        'news/weekly_newsletter.html',
+        'news/weekly_newsletter.txt',
+        {'posts': posts, 'site_url': settings.SITE_URL},
+    )
+
+
+def advance_watermarks(delivered):
+    # одна вставка с обновлением при конфликте: отметки батча сдвигаются атомарно
+    with transaction.atomic():
+        NewsletterWatermark.objects.bulk_create(
+            [NewsletterWatermark(user_id=user_id, delivered_until=until) for user_id, until in delivered.items()],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['delivered_until'],
+        )
+
+
+def send_each(connection, messages):
+    # постоянный отказ по одному адресу не срывает пачку: письмо пропускается, отметка получателя
+    # всё равно сдвигается, чтобы не повторять его каждую неделю; временные ошибки поднимаются выше
+    sent = 0
+    for message in messages:
+        try:
+            sent += connection.send_messages([message])
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as e:
+            if getattr(e, 'smtp_code', 500) < 500:
+                raise
+            logger.warning(f"Письмо рассылки для {', '.join(message.to)} не принято: {e}")
+    return sent
+
+
+def send_weekly_digest(since=None, until=None, user_range=None):
+    until = until or timezone.now()
+    since = since or until - timedelta(days=settings.NEWSLETTER_LOOKBACK_DAYS)
+
+    posts = Post.objects.filter(timestamp__gte=since, timestamp__lt=until).only('id', 'title', 'timestamp').in_bulk()
+    prepared = {}
+    subject = 'Новые статьи по вашим подпискам'
+    from_email = settings.DEFAULT_FROM_EMAIL
+    sent = 0
+
+    with get_connection() as connection:
+        for batch in chunked(iter_digests(since, until, user_range), get_batch_size()):
+            messages = []
+            delivered = {}
+            for user_id, username, email, post_ids in batch:
+                user_posts = [posts[pk] for pk in post_ids if pk in posts]
+                if not user_posts:
+                    continue
+                # у пользователей с одинаковым набором постов письмо рендерится один раз
+                key = tuple(post_ids)
+                if key not in prepared:
+                    prepared[key] = prepare_digest(user_posts)
+                text_content, html_content = prepared[key].render(username)
+
+                msg = EmailMultiAlternatives(subject, text_content, from_email, [email], connection=connection)
+                msg.attach_alternative(html_content, "text/html")
+                messages.append(msg)
+                delivered[user_id] = max(post.timestamp for post in user_posts)
+
+            sent += send_each(connection, messages)
+            advance_watermarks(delivered)
+
+    return sent
@@ -1,7 +1,9 @@
+from django.db import connections
 from django.forms import DateInput
 from django_filters import FilterSet, DateFilter, CharFilter
 
 from .models import Post
+from .search import get_search_backend
 
 
 class NewsFilter(FilterSet):
@@ -12,10 +14,10 @@ class NewsFilter(FilterSet):
         widget=DateInput(attrs={'type': 'date'}),
         input_formats=['%Y-%m-%d', '%d.%m.%Y']
     )
+    # параметр остался title, чтобы не ломать старые ссылки, но ищет по заголовку и тексту
     title = CharFilter(
-        field_name='title',
-        lookup_expr='icontains',
-        label='Заголовок:'
+        method='search',
+        label='Поиск по тексту:'
     )
     author = CharFilter(
         field_name='author__user__username',
@@ -28,4 +30,11 @@ class NewsFilter(FilterSet):
         fields = {
         }
 
+    @property
+    def search_query(self):
+        return self.form.cleaned_data.get('title', '') if self.is_valid() else ''
+
+    def search(self, queryset, name, value):
+        return get_search_backend(connections[queryset.db]).search(queryset, value)
+
 
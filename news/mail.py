@@ -0,0 +1,151 @@
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+class ConnectionPool:
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                connection = self.idle.pop()
+            try:
+                if connection.noop()[0] == 250:
+                    return connection
+            except (smtplib.SMTPException, OSError):
+                pass
+            _close_quietly(connection)
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        connection.close()
+
+
+_state = {'pid': None, 'pools': {}, 'buckets': {}}
+_state_lock = threading.Lock()
+
+
+def _process_state():
+    # после fork (prefork-воркеры celery) соединения родителя использовать нельзя
+    with _state_lock:
+        if _state['pid'] != os.getpid():
+            _state.update(pid=os.getpid(), pools={}, buckets={})
+        return _state
+
+
+def is_transient(error):
+    # SMTPException наследует OSError, поэтому ответы сервера разбираются по коду до проверки на OSError
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+class PooledEmailBackend(EmailBackend):
+    # SMTP-бэкенд с пулом постоянных соединений на процесс, token bucket и переподключением.
+    # Подключается через EMAIL_BACKEND, поэтому работает и с msg.send(), и с get_connection().send_messages()
+    def __init__(self, *args, pool_size=None, rate_limit=None, burst=None, retries=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_size = settings.EMAIL_POOL_SIZE if pool_size is None else pool_size
+        self.rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+        self.burst = settings.EMAIL_RATE_BURST if burst is None else burst
+        self.retries = settings.EMAIL_SEND_RETRIES if retries is None else retries
+
+    @property
+    def pool_key(self):
+        return self.host, self.port, self.username, self.use_ssl, self.use_tls
+
+    @property
+    def pool(self):
+        pools = _process_state()['pools']
+        with _state_lock:
+            return pools.setdefault(self.pool_key, ConnectionPool(self.pool_size))
+
+    @property
+    def bucket(self):
+        if not self.rate_limit:
+            return None
+        buckets = _process_state()['buckets']
+        with _state_lock:
+            return buckets.setdefault(self.pool_key, TokenBucket(self.rate_limit, self.burst))
+
+    def open(self):
+        if self.connection:
+            return False
+        self.connection = self.pool.acquire()
+        if self.connection is not None:
+            return True
+        return super().open()
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        self.pool.release(connection)
+
+    def reconnect(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.close()
+        super().open()
+
+    def _send(self, email_message):
+        bucket = self.bucket
+        if bucket is not None:
+            bucket.acquire()
+
+        for attempt in range(self.retries + 1):
+            try:
+                return super()._send(email_message)
+            except (smtplib.SMTPException, OSError) as error:
+                if attempt == self.retries or not is_transient(error):
+                    raise
+                logger.warning("SMTP: временная ошибка (%s), переподключение, попытка %s", error, attempt + 1)
+                time.sleep(2 ** attempt * 0.5)
+                self.reconnect()
+                if self.connection is None:
+                    return False
@@ -0,0 +1,67 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from news.retention import PostArchive, archive_batch, expired_posts, next_batch, retention_cutoff
+
+
+class Command(BaseCommand):
+    help = "Переносит посты старше срока хранения в сжатый архив и удаляет их из базы небольшими пачками"
+
+    # python manage.py archive_posts --days 730 --batch-size 500 --sleep 0.5
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.POST_RETENTION_DAYS, help='Срок хранения постов в днях')
+        parser.add_argument('--batch-size', type=int, default=500, help='Постов в одной транзакции')
+        parser.add_argument('--sleep', type=float, default=0.5, help='Пауза между пачками в секундах')
+        parser.add_argument('--limit', type=int, help='Архивировать не больше указанного числа постов')
+        parser.add_argument('--archive-dir', default=settings.POST_ARCHIVE_DIR, help='Каталог для файлов архива')
+        parser.add_argument('--no-archive', action='store_true', help='Только удалить, без записи в архив')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать посты старше срока')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("Срок хранения должен быть не меньше одного дня")
+
+        cutoff = retention_cutoff(options['days'])
+        total = expired_posts(cutoff).count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        self.stdout.write(f"Постов старше {cutoff:%d.%m.%Y %H:%M}: {total}")
+        if options['dry_run'] or not total:
+            return
+
+        archive = None
+        if not options['no_archive']:
+            path = Path(options['archive_dir']) / f"posts-{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz"
+            archive = PostArchive(str(path))
+            self.stdout.write(f"Архив: {path}")
+
+        started = time.monotonic()
+        archived = comments = 0
+        last_pk = 0
+        try:
+            while archived < total:
+                post_ids = next_batch(cutoff, last_pk, min(options['batch_size'], total - archived))
+                if not post_ids:
+                    break
+                last_pk = post_ids[-1]
+                posts, batch_comments = archive_batch(post_ids, archive)
+                archived += posts
+                comments += batch_comments
+                self.stdout.write(
+                    f"{archived}/{total} постов, {comments} комментариев, "
+                    f"{archived / (time.monotonic() - started):.0f} постов/с"
+                )
+                # пауза между короткими транзакциями: архивация не занимает базу непрерывно, пока сайт работает
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        finally:
+            if archive is not None:
+                archive.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Архивировано постов: {archived}, комментариев: {comments} за {time.monotonic() - started:.1f} с"
+        ))
@@ -0,0 +1,60 @@
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from news.benchmarks import LOCMEM_CACHES, isolated_database, seed
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк условных GET: трафик и процессорное время для повторных визитов и краулеров"
+
+    # python manage.py bench_conditional_get --posts 500 --requests 200
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10, help='Количество категорий')
+        parser.add_argument('--posts', type=int, default=500, help='Количество постов')
+        parser.add_argument('--requests', type=int, default=200, help='Повторных запросов на страницу')
+
+    def handle(self, *args, **options):
+        # отдельный кэш в памяти, чтобы не засорять рабочий ключами временной базы
+        with isolated_database(), override_settings(CACHES=LOCMEM_CACHES, ALLOWED_HOSTS=['testserver']):
+            self.stdout.write("Заполнение базы...")
+            posts = seed(options['categories'], 0, options['posts'])
+            category = posts[0].category.first()
+            urls = [
+                ('Список новостей', reverse('news_list')),
+                ('Страница поста', reverse('post_detail', args=[posts[0].pk])),
+                ('Категория', reverse('category_posts', args=[category.pk])),
+            ]
+            for name, url in urls:
+                self.run_scenario(name, url, options['requests'])
+
+    def run_scenario(self, name, url, requests):
+        client = Client()
+        self.stdout.write(f"{name} ({url}):")
+        self.measure(client, 'полный рендер (кэш пуст)', url, requests, cold=True)
+
+        # валидаторы берутся после очистки кэша: версии тегов в нём входят в ETag
+        first = client.get(url)
+        self.measure(client, 'обычный визит (из кэша)', url, requests)
+        self.measure(client, 'повторный визит (If-None-Match)', url, requests, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.measure(client, 'краулер (If-Modified-Since)', url, requests, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+
+    def measure(self, client, label, url, requests, cold=False, **headers):
+        sent = 0
+        statuses = set()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        for _ in range(requests):
+            if cold:
+                caches['default'].clear()
+            response = client.get(url, **headers)
+            statuses.add(response.status_code)
+            sent += len(response.content)
+        elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+        self.stdout.write(
+            f"  {label}: ответы {sorted(statuses)}, {sent / requests:.0f} байт/запрос, "
+            f"{cpu / requests * 1000:.2f} мс CPU/запрос, {requests / elapsed:.0f} запросов/с"
+        )
@@ -0,0 +1,41 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from news.models import Post
+from news.notifications import get_post_url, prepare_post_notification
+
+
+class Command(BaseCommand):
+    help = "Сравнивает стоимость рендера уведомления о посте на одного получателя: до и после предрендера"
+
+    # python manage.py bench_notification_render --recipients 20000
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000, help='Количество получателей')
+
+    def handle(self, *args, **options):
+        recipients = options['recipients']
+        post = Post(pk=1, title='Заголовок новости', content='Текст новости. ' * 200)
+        usernames = [f'user{i}' for i in range(recipients)]
+
+        started = perf_counter()
+        for username in usernames:
+            render_to_string('news/post_notification.html', {
+                'username': username,
+                'post': post,
+                'post_url': get_post_url(post),
+            })
+            render_to_string('news/post_notification.txt', {'username': username, 'post': post})
+        before = perf_counter() - started
+
+        started = perf_counter()
+        prepared = prepare_post_notification(post)
+        for username in usernames:
+            prepared.render(username)
+        after = perf_counter() - started
+
+        self.stdout.write(f"Получателей: {recipients}")
+        self.stdout.write(f"render_to_string на каждого: {before * 1e6 / recipients:.1f} мкс/получатель")
+        self.stdout.write(f"Предрендер + подстановка: {after * 1e6 / recipients:.1f} мкс/получатель")
+        self.stdout.write(self.style.SUCCESS(f"Ускорение: x{before / after:.1f}"))
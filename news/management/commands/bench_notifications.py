@@ -0,0 +1,71 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from DjangoProjectNewsPortal.celery import app
+from news import notifications
+from news.benchmarks import SMTPSink, Timer, isolated_database, peak_rss_mb, seed
+from news.tasks import send_new_post_notification, send_weekly_newsletter
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк рассылок: сидирует данные во временной базе и отправляет письма на локальный SMTP-приёмник"
+
+    # python manage.py bench_notifications --categories 10 --subscribers 20000 --posts 500
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10, help='Количество категорий')
+        parser.add_argument('--subscribers', type=int, default=5000, help='Количество подписчиков')
+        parser.add_argument('--posts', type=int, default=200, help='Количество постов за неделю')
+        parser.add_argument('--batch-size', type=int, default=None, help='Размер батча получателей')
+
+    def handle(self, *args, **options):
+        eager = app.conf.task_always_eager, app.conf.result_backend
+        app.conf.task_always_eager = True
+        app.conf.result_backend = 'cache+memory://'
+
+        try:
+            with isolated_database(), SMTPSink() as sink, override_settings(
+                EMAIL_BACKEND='news.mail.PooledEmailBackend',
+                EMAIL_HOST=sink.host,
+                EMAIL_PORT=sink.port,
+                EMAIL_HOST_USER='',
+                EMAIL_HOST_PASSWORD='',
+                EMAIL_USE_SSL=False,
+                EMAIL_USE_TLS=False,
+                EMAIL_RATE_LIMIT=0,
+                NEWS_NOTIFICATION_BATCH_SIZE=options['batch_size'] or notifications.get_batch_size(),
+            ):
+                self.stdout.write("Заполнение базы...")
+                posts = seed(options['categories'], options['subscribers'], options['posts'])
+
+                self.run_scenario('Новый пост', sink, lambda: send_new_post_notification(posts[0].pk))
+                self.run_scenario('Еженедельная рассылка', sink, send_weekly_newsletter)
+        finally:
+            app.conf.task_always_eager, app.conf.result_backend = eager
+
+        self.stdout.write(self.style.SUCCESS(f"Пиковый RSS: {peak_rss_mb():.1f} МБ"))
+
+    def run_scenario(self, name, sink, func):
+        timer = Timer()
+        prepared_class = notifications.PreparedNotification
+        original = prepared_class.__init__, prepared_class.render
+        prepared_class.__init__, prepared_class.render = timer.wrap(original[0]), timer.wrap(original[1])
+
+        sent_before = sink.count
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                started = perf_counter()
+                func()
+                elapsed = perf_counter() - started
+        finally:
+            prepared_class.__init__, prepared_class.render = original
+
+        sent = sink.count - sent_before
+        per_message = len(queries) / sent if sent else 0
+        self.stdout.write(
+            f"{name}: писем {sent}, {elapsed:.2f} с, {sent / elapsed:.0f} писем/с, "
+            f"запросов к БД {len(queries)} ({per_message:.3f} на письмо), "
+            f"рендер {timer.elapsed * 1000:.0f} мс"
+        )
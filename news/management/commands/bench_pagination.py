@@ -0,0 +1,65 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from news.benchmarks import LOCMEM_CACHES, isolated_database, seed
+from news.models import Category, Post
+from news.pagination import NEXT, encode_cursor
+from news.views import NewsListView
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк пагинации: первая и глубокая страница ленты по номеру (OFFSET) и по курсору"
+
+    # python manage.py bench_pagination --posts 1000000 --page 10000
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000000, help='Количество постов')
+        parser.add_argument('--categories', type=int, default=10, help='Количество категорий')
+        parser.add_argument('--page', type=int, default=10000, help='Номер глубокой страницы')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        with isolated_database(), override_settings(CACHES=LOCMEM_CACHES, ALLOWED_HOSTS=['testserver']):
+            self.stdout.write("Заполнение базы...")
+            started = perf_counter()
+            seed(options['categories'], 0, options['posts'], batch_size=10000, keep_posts=False, content='Текст новости.')
+            self.stdout.write(f"Заполнено за {perf_counter() - started:.1f} с")
+
+            page_size = NewsListView.paginate_by
+            category = Category.objects.first()
+            feeds = [
+                ('Лента', reverse('news_list'), Post.objects.all()),
+                ('Категория', reverse('category_posts', args=[category.pk]), Post.objects.filter(category=category)),
+            ]
+            for name, url, queryset in feeds:
+                depth = min(options['page'], max(queryset.count() // page_size, 1))
+                # курсор той же глубины: последний пост предыдущей страницы
+                boundary = queryset.order_by('-timestamp', '-pk')[(depth - 1) * page_size - 1] if depth > 1 else None
+                deep_cursor = f'{url}?cursor={encode_cursor(boundary, NEXT)}' if boundary else url
+
+                self.stdout.write(f"{name}:")
+                self.measure('страница 1 по номеру', f'{url}?page=1', options['repeat'])
+                self.measure(f'страница {depth} по номеру', f'{url}?page={depth}', options['repeat'])
+                self.measure('страница 1 по курсору', url, options['repeat'])
+                self.measure(f'страница {depth} по курсору', deep_cursor, options['repeat'])
+
+    def measure(self, label, url, repeat):
+        client = Client()
+        timings = []
+        separator = '&' if '?' in url else '?'
+        for attempt in range(repeat):
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                started = perf_counter()
+                # уникальный параметр обходит кэш страниц: измеряется выборка ленты, а не попадание в кэш
+                response = client.get(f'{url}{separator}bench={attempt}')
+                timings.append(perf_counter() - started)
+        sql_time = sum(float(query['time']) for query in queries)
+        self.stdout.write(
+            f"  {label}: статус {response.status_code}, медиана {sorted(timings)[len(timings) // 2] * 1000:.1f} мс, "
+            f"запросов {len(queries)}, время SQL {sql_time * 1000:.1f} мс"
+        )
@@ -0,0 +1,69 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from news.benchmarks import isolated_database, seed
+from news.models import Post
+from news.search import BasicSearchBackend, get_search_backend
+from news.views import NewsSearchView
+
+SYLLABLES = ['ка', 'ро', 'ми', 'ну', 'ле', 'сто', 'вра', 'пол', 'дин', 'мар', 'тек', 'зо', 'бри', 'гу', 'шан', 'фе']
+ENDINGS = ['а', 'ы', 'е', 'у', 'ой', 'ами']
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(3)))
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк поиска: LIKE по заголовку и тексту против полнотекстового индекса на растущем числе постов"
+
+    # python manage.py bench_search --sizes 10000 100000 300000
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Размеры базы постов')
+        parser.add_argument('--words', type=int, default=40, help='Слов в тексте поста')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        stems = vocabulary(2000, rng)
+
+        def content(i):
+            # частоты слов по закону Ципфа: первые основы встречаются почти везде, хвост - редко
+            return ' '.join(
+                stems[min(int(rng.paretovariate(1.0)) - 1, len(stems) - 1)] + rng.choice(ENDINGS)
+                for _ in range(options['words'])
+            )
+
+        queries = [
+            ('частое слово', f'{stems[0]}ы'),
+            ('редкое слово', f'{stems[300]}ой'),
+            ('два слова', f'{stems[3]}ами {stems[40]}у'),
+        ]
+        for size in options['sizes']:
+            with isolated_database():
+                self.stdout.write(f"Заполнение базы: {size} постов...")
+                started = perf_counter()
+                seed(3, 0, size, batch_size=10000, keep_posts=False, content=content)
+                self.stdout.write(f"Заполнено за {perf_counter() - started:.1f} с")
+
+                backends = [('LIKE', BasicSearchBackend()), ('индекс', get_search_backend(connection))]
+                for label, query in queries:
+                    for name, backend in backends:
+                        self.measure(f'{label}, {name}', backend.search(Post.objects.all(), query), options['repeat'])
+
+    def measure(self, label, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = perf_counter()
+            page = list(queryset[:NewsSearchView.paginate_by])
+            timings.append(perf_counter() - started)
+        self.stdout.write(
+            f"  {label}: найдено {queryset.count()}, первая страница {len(page)}, "
+            f"медиана {sorted(timings)[len(timings) // 2] * 1000:.1f} мс"
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from news.cache_backends import STATS_KEY_PREFIX, shared_cache
+
+COUNTERS = [
+    'local_hits', 'local_misses', 'shared_hits', 'shared_misses',
+    'page_recomputes', 'page_stale_served', 'page_coalesced',
+]
+
+
+class Command(BaseCommand):
+    help = "Показывает счётчики попаданий и промахов по уровням кэша и сэкономленные пересчёты страниц (сумма по всем процессам)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счётчики')
+
+    def handle(self, *args, **options):
+        shared = shared_cache()
+        keys = [f'{STATS_KEY_PREFIX}{name}' for name in COUNTERS]
+        values = shared.get_many(keys)
+
+        for name, key in zip(COUNTERS, keys):
+            self.stdout.write(f"{name}: {values.get(key, 0)}")
+
+        for tier in ('local', 'shared'):
+            hits, misses = values.get(f'{STATS_KEY_PREFIX}{tier}_hits', 0), values.get(f'{STATS_KEY_PREFIX}{tier}_misses', 0)
+            if hits + misses:
+                self.stdout.write(f"Доля попаданий ({tier}): {hits / (hits + misses):.1%}")
+
+        # каждый отданный устаревший ответ и каждый дождавшийся чужого пересчёта запрос - несостоявшийся пересчёт
+        saved = values.get(f'{STATS_KEY_PREFIX}page_stale_served', 0) + values.get(f'{STATS_KEY_PREFIX}page_coalesced', 0)
+        recomputes = values.get(f'{STATS_KEY_PREFIX}page_recomputes', 0)
+        self.stdout.write(f"Пересчётов страниц: {recomputes}, сэкономлено пересчётов: {saved}")
+
+        if options['reset']:
+            shared.delete_many(keys)
+            self.stdout.write(self.style.SUCCESS("Счётчики обнулены."))
@@ -0,0 +1,84 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from news.digest import get_digest_pairs
+from news.models import Author, Category, OutboxEvent, Post, PostCategory
+from news.notifications import get_post_recipients
+from news.search import get_search_backend
+
+# SQLite: «SCAN таблица» без USING INDEX - полный проход (кроме поиска по FTS5 через VIRTUAL TABLE INDEX); Postgres: Seq Scan
+FULL_SCAN = re.compile(r'\bSCAN (?!.*\b(?:USING|VIRTUAL TABLE)\b)(\w+)|Seq Scan on (\w+)')
+SORT = re.compile(r'USE TEMP B-TREE FOR ORDER BY|\bSort\b')
+
+
+def hot_queries():
+    now = timezone.now()
+    post = Post.objects.order_by('-pk').first() or Post(pk=1, author_id=1, timestamp=now)
+    category_id = Category.objects.values_list('pk', flat=True).first() or 1
+    author_id = Author.objects.values_list('pk', flat=True).first() or 1
+    feed = Post.objects.order_by('-timestamp', '-pk')
+    seek = Q(timestamp__lte=post.timestamp), Q(timestamp__lt=post.timestamp) | Q(pk__lt=post.pk)
+    in_category = Exists(PostCategory.objects.filter(post=OuterRef('pk'), category_id=category_id))
+
+    # (название, запрос, сортировка ожидаема): выборку получателей и рассылки упорядочить индексом нельзя,
+    # но она ограничена подписчиками одного поста или одной недели; результаты поиска сортируются по релевантности
+    return [
+        ('Лента, первая страница', feed[:6], False),
+        ('Лента, страница по курсору', feed.filter(*seek)[:6], False),
+        ('Категория, первая страница', feed.filter(in_category)[:6], False),
+        ('Категория, страница по курсору', feed.filter(*seek, in_category)[:6], False),
+        ('Страница поста', Post.objects.filter(pk=post.pk), False),
+        ('Поиск по тексту', get_search_backend(connection).search(Post.objects.all(), 'новости')[:6], True),
+        ('Страница автора', Post.objects.filter(author_id=author_id).order_by('-timestamp'), False),
+        ('Лимит публикаций за сутки', Post.objects.filter(author_id=author_id, timestamp__gte=now - timedelta(days=1)), False),
+        ('Получатели уведомления о посте', get_post_recipients(post), True),
+        ('Еженедельная рассылка', get_digest_pairs(now - timedelta(days=7), now).values_list(
+            'user_id', 'category__category_posts__post_id').order_by('user_id'), True),
+        ('Outbox, неотправленные события', OutboxEvent.objects.filter(
+            Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=now), processed_at__isnull=True).order_by('pk')[:500], False),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Выполняет EXPLAIN для горячих запросов и отмечает полные просмотры таблиц и сортировки"
+
+    # python manage.py explain_queries --analyze
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (только Postgres)')
+        parser.add_argument('--verbose-plans', action='store_true', help='Печатать планы целиком')
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        if connection.vendor == 'postgresql':
+            self.stdout.write("Postgres выбирает план по статистике: на пустой базе Seq Scan ожидаем, проверяйте на реальных данных")
+
+        problems = 0
+        for name, queryset, sort_expected in hot_queries():
+            plan = queryset.explain(**explain_options)
+            scans = sorted({table for match in FULL_SCAN.finditer(plan) for table in match.groups() if table})
+            sort = not sort_expected and bool(SORT.search(plan))
+
+            if scans or sort:
+                problems += 1
+                notes = []
+                if scans:
+                    notes.append(f"полный просмотр: {', '.join(scans)}")
+                if sort:
+                    notes.append("сортировка без индекса")
+                self.stdout.write(self.style.WARNING(f"{name}: {'; '.join(notes)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: OK"))
+
+            if options['verbose_plans'] or scans or sort:
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if problems:
+            self.stdout.write(self.style.WARNING(f"Запросов с полным просмотром или сортировкой: {problems}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Все горячие запросы используют индексы"))
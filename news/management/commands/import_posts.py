@@ -0,0 +1,175 @@
+import csv
+import json
+import sys
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from news import outbox
+from news.caching import bump_tags
+from news.models import Author, Category, Post, PostCategory
+
+POST_TYPES = {
+    Post.NEWS: Post.NEWS, 'news': Post.NEWS,
+    Post.ARTICLE: Post.ARTICLE, 'article': Post.ARTICLE,
+}
+TITLE_LENGTH = Post._meta.get_field('title').max_length
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                # битая строка пропускается, как и строка с ошибкой в данных
+                yield ImportRowError(f"некорректный JSON: {e}")
+
+
+def read_csv(stream):
+    # в CSV категории перечисляются в одной колонке через |
+    for row in csv.DictReader(stream):
+        row['categories'] = [name for name in (row.get('categories') or '').split('|') if name]
+        yield row
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+def check_row(row):
+    if isinstance(row, ImportRowError):
+        raise row
+    if not isinstance(row, dict):
+        raise ImportRowError("строка должна быть объектом")
+    for field in ('title', 'content', 'author', 'post_type'):
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise ImportRowError(f"поле {field} должно быть строкой")
+    categories = row.get('categories')
+    if isinstance(categories, list):
+        if not all(isinstance(name, str) for name in categories):
+            raise ImportRowError("категории должны быть строками")
+    elif categories is not None and not isinstance(categories, str):
+        raise ImportRowError("категории должны быть списком или строкой")
+
+
+class Command(BaseCommand):
+    help = "Импортирует посты из ленты агентства (JSONL или CSV) пачками в обход сигналов на каждую строку"
+
+    # python manage.py import_posts feed.jsonl --batch-size 5000
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с постами, "-" - стандартный ввод')
+        parser.add_argument('--format', choices=list(READERS), help='Формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Постов в одной транзакции')
+        parser.add_argument('--no-notify', action='store_true', help='Не уведомлять подписчиков')
+        parser.add_argument('--start-row', type=int, default=1, help='Начать с этой строки, например после сбоя')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        if path != '-' and not Path(path).is_file():
+            raise CommandError(f"Файл {path} не найден")
+        if options['start_row'] < 1:
+            raise CommandError("Номер начальной строки должен быть не меньше 1")
+
+        # авторы и категории ищутся в словарях, а не запросом на каждую строку
+        self.authors = dict(Author.objects.values_list('user__username', 'pk'))
+        self.categories = dict(Category.objects.values_list('name', 'pk'))
+        self.notify = not options['no_notify']
+
+        started = perf_counter()
+        imported = skipped = batches = 0
+        # строка, с которой продолжать: все строки до неё либо в закоммиченных пачках, либо пропущены
+        resume_row = options['start_row']
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            rows = islice(enumerate(READERS[format](stream), 1), resume_row - 1, None)
+            while batch := list(islice(rows, options['batch_size'])):
+                posts, post_categories = [], []
+                for number, row in batch:
+                    try:
+                        check_row(row)
+                        posts.append(self.build_post(row))
+                        post_categories.append(self.category_names(row))
+                    except ImportRowError as e:
+                        skipped += 1
+                        self.stderr.write(f"Строка {number} пропущена: {e}")
+                if posts:
+                    self.import_batch(posts, post_categories)
+                    imported += len(posts)
+                    batches += 1
+                resume_row = batch[-1][0] + 1
+                self.stdout.write(
+                    f"Пачка {batches}: импортировано {imported}, {imported / (perf_counter() - started):.0f} постов/с, "
+                    f"следующая строка {resume_row}"
+                )
+        except (csv.Error, DatabaseError) as e:
+            raise CommandError(
+                f"Импорт остановлен: {e}. Закоммичено пачек: {batches}, постов: {imported}; "
+                f"продолжить: --start-row {resume_row}"
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Импортировано постов: {imported} за {elapsed:.1f} с ({imported / elapsed * 60 if elapsed else 0:.0f} в минуту), "
+            f"пропущено строк: {skipped}, закоммичено пачек: {batches}"
+        ))
+
+    def build_post(self, row):
+        title = (row.get('title') or '').strip()
+        content = (row.get('content') or '').strip()
+        if not title or not content:
+            raise ImportRowError("нет заголовка или текста")
+        if len(title) > TITLE_LENGTH:
+            raise ImportRowError(f"заголовок длиннее {TITLE_LENGTH} символов")
+        author_id = self.authors.get(row.get('author'))
+        if author_id is None:
+            raise ImportRowError(f"автор {row.get('author')!r} не найден")
+        post_type = POST_TYPES.get(row.get('post_type') or Post.NEWS)
+        if post_type is None:
+            raise ImportRowError(f"неизвестный тип {row.get('post_type')!r}")
+        return Post(author_id=author_id, post_type=post_type, title=title, content=content)
+
+    def category_names(self, row):
+        names = row.get('categories') or []
+        if isinstance(names, str):
+            names = [names]
+        return {name.strip() for name in names if name.strip()}
+
+    def resolve_categories(self, names):
+        missing = names - self.categories.keys()
+        if missing:
+            # ignore_conflicts: категорию мог одновременно создать другой импорт или редактор
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+        return bool(missing)
+
+    def import_batch(self, posts, post_categories):
+        with transaction.atomic():
+            created_categories = self.resolve_categories(set().union(*post_categories))
+            # bulk_create не отправляет post_save и m2m_changed: уведомление и сброс кэша - один раз на пачку
+            posts = Post.objects.bulk_create(posts)
+            category_ids = set()
+            links = []
+            for post, names in zip(posts, post_categories):
+                for name in names:
+                    category_ids.add(self.categories[name])
+                    links.append(PostCategory(post_id=post.pk, category_id=self.categories[name]))
+            PostCategory.objects.bulk_create(links)
+
+            if self.notify:
+                outbox.record_posts_imported([post.pk for post in posts])
+
+            tags = ['posts', *(f'category-{pk}' for pk in category_ids), *{f'author-{post.author_id}' for post in posts}]
+            if created_categories:
+                tags.append('categories')
+            transaction.on_commit(lambda: bump_tags(*tags))
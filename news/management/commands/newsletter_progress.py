@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from news.models import NewsletterRun, NewsletterShard
+from news.newsletter import dispatch_shards, get_unfinished_run
+
+
+class Command(BaseCommand):
+    help = "Показывает прогресс и скорость еженедельных рассылок, может продолжить прерванную"
+
+    # python manage.py newsletter_progress --resume  переотправляет незавершённые шарды последней рассылки
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Сколько последних рассылок показать')
+        parser.add_argument('--resume', action='store_true', help='Продолжить незавершённую рассылку')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            run = get_unfinished_run()
+            if run is None:
+                self.stdout.write(self.style.WARNING("Незавершённых рассылок нет."))
+            else:
+                dispatch_shards(run)
+                self.stdout.write(self.style.SUCCESS(f"{run}: незавершённые шарды отправлены в очередь."))
+
+        runs = NewsletterRun.objects.annotate(
+            total=Count('shards'),
+            done=Count('shards', filter=Q(shards__status=NewsletterShard.DONE)),
+            sent=Sum('shards__sent'),
+            first_started=Min('shards__started_at'),
+            last_finished=Max('shards__finished_at'),
+        ).order_by('-pk')[:options['runs']]
+
+        for run in runs:
+            status = 'завершена' if run.finished_at else 'в процессе'
+            sent = run.sent or 0
+            line = f"#{run.pk} {run}: {status}, шарды {run.done}/{run.total}, писем {sent}"
+            if run.first_started:
+                end = run.last_finished if run.finished_at else timezone.now()
+                elapsed = (end - run.first_started).total_seconds() or 1
+                line += f", {elapsed:.1f} с, {sent / elapsed:.1f} писем/с"
+            self.stdout.write(line)
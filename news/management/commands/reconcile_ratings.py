@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+
+from news.caching import bump_tags
+from news.models import Author
+
+FIELDS = ['post_rating', 'comment_rating', 'post_comments_rating', 'rating']
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает рейтинги всех авторов одним запросом и исправляет расхождения с накопленными значениями"
+
+    # python manage.py reconcile_ratings --dry-run
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Авторов, читаемых из базы за раз')
+
+    def handle(self, *args, **options):
+        authors = Author.objects.with_actual_ratings()
+        drift = Q()
+        for field in FIELDS:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+
+        fixed = 0
+        for author in authors.filter(drift).select_related('user').iterator(chunk_size=options['chunk_size']):
+            self.stdout.write(
+                f"{author}: рейтинг {author.rating:g} -> {author.actual_rating:g} "
+                f"(посты {author.post_rating:g} -> {author.actual_post_rating:g}, "
+                f"комментарии {author.comment_rating:g} -> {author.actual_comment_rating:g}, "
+                f"комментарии к постам {author.post_comments_rating:g} -> {author.actual_post_comments_rating:g})"
+            )
+            if options['dry_run']:
+                continue
+            # исправляется разница, а не записывается итог: оценки, поставленные во время сверки, не теряются
+            with transaction.atomic():
+                Author.objects.filter(pk=author.pk).update(**{
+                    field: F(field) + (getattr(author, f'actual_{field}') - getattr(author, field)) for field in FIELDS
+                })
+                transaction.on_commit(lambda pk=author.pk: bump_tags(f'author-{pk}'))
+            fixed += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING("Пробный запуск, ничего не изменено"))
+        elif fixed:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено авторов: {fixed}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Расхождений нет, проверено авторов: {authors.count()}"))
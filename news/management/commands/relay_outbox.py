@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from news.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    help = "Отправляет накопленные события outbox в Celery"
+
+    # python manage.py relay_outbox --loop  работает постоянно, как отдельный процесс
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать в цикле')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между проходами, если очередь пуста')
+        parser.add_argument('--batch-size', type=int, default=None, help='Событий за один проход')
+
+    def handle(self, *args, **options):
+        while True:
+            sent = relay_outbox(options['batch_size'])
+            if sent:
+                self.stdout.write(f"Отправлено событий: {sent}")
+            if not options['loop']:
+                break
+            if not sent:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS("Готово."))
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from news.models import Author, Category, Post
+from news.pagination import NEXT, encode_cursor
+from news.views import CategoryDetailView, NewsListView
+
+
+class Command(BaseCommand):
+    help = "Прогревает кэш страниц: главная, свежие страницы категорий, списки, топ авторов и популярные посты"
+
+    # python manage.py warm_cache --pages 3 --workers 8
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=3, help='Сколько первых страниц списков прогревать')
+        parser.add_argument('--authors', type=int, default=20, help='Сколько авторов с наибольшим рейтингом')
+        parser.add_argument('--posts', type=int, default=50, help='Сколько популярных постов')
+        parser.add_argument('--days', type=int, default=7, help='За сколько дней считать посты популярными')
+        parser.add_argument('--workers', type=int, default=4, help='Количество потоков')
+        parser.add_argument('--host', default=None, help='Хост, под которым страницы попадут в кэш (по умолчанию из SITE_URL)')
+
+    def handle(self, *args, **options):
+        site = urlsplit(settings.SITE_URL)
+        host = options['host'] or site.netloc
+        secure = site.scheme == 'https'
+        urls = self.collect_urls(options)
+
+        def warm(url):
+            started = time.perf_counter()
+            try:
+                # ключ кэша зависит от хоста и схемы, поэтому запрос должен выглядеть как запрос посетителя
+                response = Client(HTTP_HOST=host).get(url, secure=secure)
+                return url, response.status_code, time.perf_counter() - started
+            finally:
+                connections.close_all()
+
+        self.stdout.write(f"Прогрев {len(urls)} страниц в {options['workers']} потоков...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            results = list(executor.map(warm, urls))
+        elapsed = time.perf_counter() - started
+
+        failed = [(url, status) for url, status, _ in results if status != 200]
+        for url, status in failed:
+            self.stderr.write(f"{url}: статус {status}")
+        slowest = max(results, key=lambda result: result[2], default=None)
+        if slowest:
+            self.stdout.write(f"Самая медленная страница: {slowest[0]} ({slowest[2] * 1000:.0f} мс)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Прогрето {len(results) - len(failed)} из {len(results)} страниц за {elapsed:.2f} с"
+        ))
+
+    def collect_urls(self, options):
+        pages = options['pages']
+        urls = self.feed_urls(reverse('news_list'), Post.objects.all(), pages, NewsListView.paginate_by)
+        urls += [reverse('categories_list'), reverse('authors_list')]
+
+        for category_id in Category.objects.values_list('id', flat=True):
+            posts = Post.objects.filter(category__id=category_id)
+            url = reverse('category_posts', args=[category_id])
+            urls += self.feed_urls(url, posts, pages, CategoryDetailView.paginate_by)
+
+        top_authors = Author.objects.order_by('-rating').values_list('pk', flat=True)[:options['authors']]
+        urls += [reverse('author_detail', args=[pk]) for pk in top_authors]
+
+        since = timezone.now() - timedelta(days=options['days'])
+        popular = Post.objects.filter(timestamp__gte=since).order_by('-rating', '-timestamp').values_list('pk', flat=True)
+        urls += [reverse('post_detail', args=[pk]) for pk in popular[:options['posts']]]
+        return urls
+
+    def feed_urls(self, url, queryset, pages, page_size):
+        # посетители листают ленту по курсорам; курсор страницы - последний пост предыдущей
+        boundaries = queryset.order_by('-timestamp', '-pk').only('pk', 'timestamp')[:page_size * (pages - 1)]
+        last_posts = list(boundaries)[page_size - 1::page_size]
+        return [url] + [f'{url}?cursor={encode_cursor(post, NEXT)}' for post in last_posts]
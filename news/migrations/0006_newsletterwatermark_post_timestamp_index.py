@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('news', '0005_newsletterrun_newslettershard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterWatermark',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='newsletter_watermark', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('delivered_until', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:14
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    # существующие посты считаются не менявшимися с публикации
+    Post = apps.get_model('news', 'Post')
+    Post.objects.update(updated_at=F('timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0006_newsletterwatermark_post_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
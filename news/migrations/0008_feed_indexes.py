@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0007_post_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['timestamp', 'id'], name='news_post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'timestamp'], name='news_post_author_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postcategory',
+            index=models.Index(fields=['category', 'post'], name='news_postcat_category_idx'),
+        ),
+        # одиночный индекс по timestamp удаляется после создания составного, который его покрывает
+        migrations.AlterField(
+            model_name='post',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+    ]
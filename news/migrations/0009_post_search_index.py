@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:02
+
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from news.search import get_search_backend
+    get_search_backend(schema_editor.connection).install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from news.search import get_search_backend
+    get_search_backend(schema_editor.connection).uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0008_feed_indexes'),
+    ]
+
+    operations = [
+        # индекс зависит от базы: FTS5 с триггерами в SQLite, GIN по tsvector в Postgres
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
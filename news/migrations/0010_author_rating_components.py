@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:45
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def totals(queryset, group_by):
+    return dict(queryset.order_by().values(group_by).annotate(total=Sum('rating')).values_list(group_by, 'total'))
+
+
+def backfill_rating_components(apps, schema_editor):
+    # составляющие считаются заново, общий рейтинг пересобирается из них
+    Author = apps.get_model('news', 'Author')
+    Post = apps.get_model('news', 'Post')
+    Comment = apps.get_model('news', 'Comment')
+    post_rating = totals(Post.objects.all(), 'author')
+    comment_rating = totals(Comment.objects.all(), 'user')
+    post_comments_rating = totals(Comment.objects.all(), 'post__author')
+
+    authors = list(Author.objects.all())
+    for author in authors:
+        author.post_rating = post_rating.get(author.pk) or 0
+        author.comment_rating = comment_rating.get(author.pk) or 0
+        author.post_comments_rating = post_comments_rating.get(author.pk) or 0
+        author.rating = author.post_rating * 3 + author.comment_rating + author.post_comments_rating
+    Author.objects.bulk_update(
+        authors, ['post_rating', 'comment_rating', 'post_comments_rating', 'rating'], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0009_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='comment_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='post_comments_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='post_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_components, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0010_author_rating_components'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='event_type',
+            field=models.CharField(choices=[('post_created', 'Пост создан'), ('posts_imported', 'Посты импортированы')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0011_outboxevent_posts_imported'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newslettershard',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='newslettershard',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10),
+        ),
+    ]
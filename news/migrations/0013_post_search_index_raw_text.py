@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:40
+
+from django.db import migrations
+
+
+def reinstall_search_index(apps, schema_editor):
+    # старые триггеры вызывали функцию news_stem из Python; индекс пересобирается по тексту как есть
+    from news.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection)
+    backend.uninstall(schema_editor.connection)
+    backend.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0012_newslettershard_attempts_failed'),
+    ]
+
+    operations = [
+        migrations.RunPython(reinstall_search_index, reinstall_search_index),
+    ]
@@ -1,15 +1,39 @@
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.template.loader import render_to_string
 from django.urls import reverse
 
 from DjangoProjectNewsPortal import settings
-from django.core.cache import cache
+from .caching import bump_tags
 
 User = get_user_model()
 
+POST_RATING_WEIGHT = 3
+
+
+def rating_total(queryset, group_by):
+    totals = queryset.order_by().values(group_by).annotate(total=Sum('rating')).values('total')
+    return Coalesce(Subquery(totals), Value(0.0), output_field=FloatField())
+
+
+class AuthorQuerySet(models.QuerySet):
+    def with_actual_ratings(self):
+        # пересчёт из постов и комментариев одним запросом: по подзапросу на каждую составляющую
+        return self.annotate(
+            actual_post_rating=rating_total(Post.objects.filter(author=OuterRef('pk')), 'author'),
+            actual_comment_rating=rating_total(Comment.objects.filter(user=OuterRef('pk')), 'user'),
+            actual_post_comments_rating=rating_total(
+                Comment.objects.filter(post__author=OuterRef('pk')), 'post__author'
+            ),
+        ).annotate(
+            actual_rating=F('actual_post_rating') * POST_RATING_WEIGHT
+            + F('actual_comment_rating') + F('actual_post_comments_rating'),
+        )
+
+
 class Author(models.Model):
     user = models.OneToOneField(
         User,
@@ -18,18 +42,42 @@ class Author(models.Model):
         related_name='author_profile'
     )
     rating = models.FloatField(default=0)
+    # составляющие рейтинга: сумма рейтингов постов, комментариев автора и комментариев к его постам
+    post_rating = models.FloatField(default=0)
+    comment_rating = models.FloatField(default=0)
+    post_comments_rating = models.FloatField(default=0)
     subscribers = models.ManyToManyField(User, related_name='author_subscribers', blank=True)
 
+    objects = AuthorQuerySet.as_manager()
+
     def __str__(self):
         return self.user.username
 
+    @property
+    def current_rating(self):
+        from .votes import pending_author_rating
+        return self.rating + pending_author_rating(self.pk)
+
     def update_rating(self):
-        post_rating = self.posts.aggregate(pr=Sum('rating'))['pr'] or 0
-        post_rating *= 3
-        comment_rating = self.user.comments.aggregate(cr=Sum('rating'))['cr'] or 0
-        post_comments_rating = Comment.objects.filter(post__author=self).aggregate(pcr=Sum('rating'))['pcr'] or 0
-        self.rating = post_rating + comment_rating + post_comments_rating
-        self.save()
+        actual = Author.objects.with_actual_ratings().get(pk=self.pk)
+        self.post_rating = actual.actual_post_rating
+        self.comment_rating = actual.actual_comment_rating
+        self.post_comments_rating = actual.actual_post_comments_rating
+        self.rating = actual.actual_rating
+        self.save(update_fields=['post_rating', 'comment_rating', 'post_comments_rating', 'rating'])
+
+    @staticmethod
+    def add_rating(pk, post=0, comment=0, post_comments=0):
+        # F() складывает в базе, поэтому одновременные оценки не затирают друг друга;
+        # расхождения, если они всё же появятся, исправляет manage.py reconcile_ratings
+        updated = Author.objects.filter(pk=pk).update(
+            post_rating=F('post_rating') + post,
+            comment_rating=F('comment_rating') + comment,
+            post_comments_rating=F('post_comments_rating') + post_comments,
+            rating=F('rating') + post * POST_RATING_WEIGHT + comment + post_comments,
+        )
+        if updated:
+            transaction.on_commit(lambda: bump_tags(f'author-{pk}'))
 
 
 class Category(models.Model):
@@ -57,17 +105,34 @@ class Post(models.Model):
     rating = models.FloatField(default=0)
     category = models.ManyToManyField(Category, through='PostCategory')
     timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # лента, поиск и курсорная пагинация: ORDER BY timestamp, id и поиск по (timestamp, id)
+            models.Index(fields=['timestamp', 'id'], name='news_post_feed_idx'),
+            # лимит публикаций за сутки и страница автора
+            models.Index(fields=['author', 'timestamp'], name='news_post_author_time_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def like(self):
-        self.rating += 1
-        self.save()
+        self.change_rating(1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        self.change_rating(-1)
+
+    def change_rating(self, delta):
+        from .votes import record_post_vote
+        record_post_vote(self, delta)
+
+    @property
+    def current_rating(self):
+        # rating в базе плюс голоса, ещё не записанные flush_votes
+        from .votes import pending_votes
+        return self.rating + pending_votes('post', [self.pk]).get(self.pk, 0)
 
     def preview(self):
         return f"{self.content[:150]}..." if len(self.content) > 150 else self.content
@@ -75,10 +140,6 @@ class Post(models.Model):
     def get_absolute_url(self):
         return reverse('post_detail', args=[str(self.id)])
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-
-        cache.delete(f'post-{self.pk}')
 
 
 
@@ -88,6 +149,10 @@ class PostCategory(models.Model):
 
     class Meta:
         unique_together = ('post', 'category')
+        indexes = [
+            # посты категории и рассылки: от категории к постам (уникальный индекс идёт от поста)
+            models.Index(fields=['category', 'post'], name='news_postcat_category_idx'),
+        ]
 
     def __str__(self):
         return f'{self.post.title} - {self.category.name}'
@@ -105,9 +170,104 @@ class Comment(models.Model):
         return f'Комментарий от {self.user.username}'
 
     def like(self):
-        self.rating += 1
-        self.save()
+        self.change_rating(1)
 
     def dislike(self):
-        self.rating -= 1
-        self.save()
+        self.change_rating(-1)
+
+    def change_rating(self, delta):
+        from .votes import record_comment_vote
+        record_comment_vote(self, self.post_author_id, delta)
+
+    @property
+    def current_rating(self):
+        from .votes import pending_votes
+        return self.rating + pending_votes('comment', [self.pk]).get(self.pk, 0)
+
+    @property
+    def post_author_id(self):
+        return Post.objects.filter(pk=self.post_id).values_list('author_id', flat=True).first()
+
+    def add_author_rating(self, delta):
+        # комментарий входит в рейтинг своего автора и в рейтинг автора поста
+        Author.add_rating(self.user_id, comment=delta)
+        post_author_id = self.post_author_id
+        if post_author_id is not None:
+            Author.add_rating(post_author_id, post_comments=delta)
+
+
+class OutboxEvent(models.Model):
+    POST_CREATED = 'post_created'
+    POSTS_IMPORTED = 'posts_imported'
+    EVENT_TYPES = [
+        (POST_CREATED, 'Пост создан'),
+        (POSTS_IMPORTED, 'Посты импортированы'),
+    ]
+
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=Q(processed_at__isnull=True), name='news_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} ({self.idempotency_key})'
+
+
+class NewsletterRun(models.Model):
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Рассылка {self.period_start:%d.%m.%Y} - {self.period_end:%d.%m.%Y}'
+
+
+class NewsletterShard(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Ожидает'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    run = models.ForeignKey(NewsletterRun, on_delete=models.CASCADE, related_name='shards')
+    first_user_id = models.BigIntegerField()
+    last_user_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    sent = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['first_user_id']
+
+    def __str__(self):
+        return f'{self.run}: пользователи {self.first_user_id}-{self.last_user_id}'
+
+
+class NewsletterWatermark(models.Model):
+    # время самого нового поста, уже доставленного подписчику в рассылке
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='newsletter_watermark'
+    )
+    delivered_until = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user_id}: {self.delivered_until}'
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from celery import chord
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .digest import get_digest_pairs
+from .models import NewsletterRun, NewsletterShard
+from .notifications import chunked
+
+
+def plan_shards(run, shard_size=None):
+    # диапазоны id подписчиков по shard_size получателей; границы считаются одним потоковым запросом
+    shard_size = shard_size or settings.NEWSLETTER_SHARD_SIZE
+    user_ids = (
+        get_digest_pairs(run.period_start, run.period_end)
+        .values_list('user_id', flat=True)
+        .distinct()
+        .order_by('user_id')
+    )
+    return [
+        NewsletterShard(run=run, first_user_id=ids[0], last_user_id=ids[-1])
+        for ids in chunked(user_ids.iterator(), shard_size)
+    ]
+
+
+def get_unfinished_run():
+    return NewsletterRun.objects.filter(finished_at__isnull=True).order_by('-pk').first()
+
+
+def close_stale_run(run):
+    # оставшиеся шарды уже не отправятся; их подписчики получат посты в новой рассылке по водяным отметкам
+    with transaction.atomic():
+        run.shards.filter(status__in=[NewsletterShard.PENDING, NewsletterShard.RUNNING]).update(
+            status=NewsletterShard.FAILED, finished_at=timezone.now(),
+        )
+        NewsletterRun.objects.filter(pk=run.pk).update(finished_at=timezone.now())
+
+
+def start_newsletter_run(until=None):
+    # незавершённая рассылка продолжается с последней контрольной точки, а не начинается заново;
+    # зависшая дольше NEWSLETTER_RUN_RESUME_HOURS закрывается, и начинается рассылка за новый период
+    run = get_unfinished_run()
+    if run is not None and run.started_at < timezone.now() - timedelta(hours=settings.NEWSLETTER_RUN_RESUME_HOURS):
+        close_stale_run(run)
+        run = None
+    if run is None:
+        until = until or timezone.now()
+        with transaction.atomic():
+            run = NewsletterRun.objects.create(
+                period_start=until - timedelta(days=settings.NEWSLETTER_LOOKBACK_DAYS),
+                period_end=until,
+            )
+            NewsletterShard.objects.bulk_create(plan_shards(run))
+
+    dispatch_shards(run)
+    return run
+
+
+def dispatch_shards(run):
+    from .tasks import finish_newsletter_run, send_newsletter_shard
+
+    pending = run.shards.exclude(status__in=[NewsletterShard.DONE, NewsletterShard.FAILED]).values_list('pk', flat=True)
+    header = [send_newsletter_shard.s(shard_id) for shard_id in pending]
+    if header:
+        chord(header)(finish_newsletter_run.si(run.pk))
+    else:
+        finish_newsletter_run.delay(run.pk)
@@ -0,0 +1,103 @@
+from collections import defaultdict
+from itertools import islice
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from .models import Author, Category
+
+User = get_user_model()
+
+
+def get_post_recipients(post):
+    # подписчики категорий поста и подписчики автора одним запросом, без дублей
+    category_subscribers = Category.subscribers.through.objects.filter(
+        category__category_posts__post_id=post.pk,
+    ).values('user_id')
+    author_subscribers = Author.subscribers.through.objects.filter(
+        author_id=post.author_id,
+    ).values('user_id')
+
+    return (
+        User.objects
+        .filter(Q(pk__in=category_subscribers) | Q(pk__in=author_subscribers))
+        .exclude(email='')
+        .order_by('pk')
+    )
+
+
+def get_posts_recipients(post_ids):
+    category_subscribers = Category.subscribers.through.objects.filter(
+        category__category_posts__post_id__in=post_ids,
+    ).values('user_id')
+    author_subscribers = Author.subscribers.through.objects.filter(
+        author__posts__in=post_ids,
+    ).values('user_id')
+
+    return (
+        User.objects
+        .filter(Q(pk__in=category_subscribers) | Q(pk__in=author_subscribers))
+        .exclude(email='')
+        .order_by('pk')
+    )
+
+
+def get_subscribed_posts(post_ids, user_ids):
+    # {пользователь: посты из post_ids, на категорию или автора которых он подписан}
+    pairs = Category.subscribers.through.objects.filter(
+        user_id__in=user_ids, category__category_posts__post_id__in=post_ids,
+    ).values_list('user_id', 'category__category_posts__post_id').union(
+        Author.subscribers.through.objects.filter(
+            user_id__in=user_ids, author__posts__in=post_ids,
+        ).values_list('user_id', 'author__posts'),
+    )
+    subscribed = defaultdict(list)
+    for user_id, post_id in pairs:
+        subscribed[user_id].append(post_id)
+    return {user_id: sorted(ids, reverse=True) for user_id, ids in subscribed.items()}
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_batch_size():
+    return getattr(settings, 'NEWS_NOTIFICATION_BATCH_SIZE', 100)
+
+
+def get_post_url(post):
+    return f"{settings.SITE_URL}{post.get_absolute_url()}"
+
+
+class PreparedNotification:
+    # шаблон рендерится один раз с маркером вместо имени, на каждого получателя остаётся только склейка строк
+    def __init__(self, html_template, text_template, context):
+        marker = f'__username_{uuid4().hex}__'
+        context = {**context, 'username': marker}
+        self.html_parts = render_to_string(html_template, context).split(marker)
+        self.text_parts = render_to_string(text_template, context).split(marker)
+
+    def render(self, username):
+        return username.join(self.text_parts), escape(username).join(self.html_parts)
+
+
+def prepare_imported_posts_notification(posts):
+    return PreparedNotification(
+        'news/imported_posts_notification.html',
+        'news/imported_posts_notification.txt',
+        {'posts': posts, 'site_url': settings.SITE_URL},
+    )
+
+
+def prepare_post_notification(post):
+    return PreparedNotification(
+        'news/post_notification.html',
+        'news/post_notification.txt',
+        {'post': post, 'post_url': get_post_url(post)},
+    )
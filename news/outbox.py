@@ -0,0 +1,97 @@
+import logging
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+EVENT_TASKS = {
+    OutboxEvent.POST_CREATED: 'news.tasks.send_new_post_notification',
+    OutboxEvent.POSTS_IMPORTED: 'news.tasks.send_imported_posts_notification',
+}
+
+
+def record_post_created(post):
+    # вызывается внутри транзакции, в которой создаётся пост
+    return OutboxEvent.objects.create(
+        event_type=OutboxEvent.POST_CREATED,
+        payload={'post_id': post.pk},
+        idempotency_key=f'{OutboxEvent.POST_CREATED}:{post.pk}',
+    )
+
+
+def record_posts_imported(post_ids):
+    # одно событие на пачку импорта: подписчик получит одно письмо со всеми постами пачки
+    return OutboxEvent.objects.create(
+        event_type=OutboxEvent.POSTS_IMPORTED,
+        payload={'post_ids': post_ids},
+        idempotency_key=f'{OutboxEvent.POSTS_IMPORTED}:{post_ids[0]}-{post_ids[-1]}',
+    )
+
+
+def relay_outbox(batch_size=None):
+    from . import tasks  # noqa: F401 - регистрирует задачи, если relay запущен вне воркера
+
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    # отправленные, но так и не обработанные события переотправляются (at-least-once)
+    redeliver_before = timezone.now() - timedelta(seconds=settings.OUTBOX_REDELIVERY_TIMEOUT)
+
+    with transaction.atomic():
+        events = OutboxEvent.objects.filter(
+            Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=redeliver_before),
+            processed_at__isnull=True,
+        ).order_by('pk')
+        if connection.features.has_select_for_update_skip_locked:
+            events = events.select_for_update(skip_locked=True)
+        events = list(events[:batch_size])
+
+        dispatched = []
+        with current_app.producer_or_acquire() as producer:
+            for event in events:
+                try:
+                    current_app.tasks[EVENT_TASKS[event.event_type]].apply_async(
+                        kwargs={**event.payload, 'event_key': event.idempotency_key},
+                        task_id=event.idempotency_key,
+                        producer=producer,
+                    )
+                except Exception:
+                    # брокер недоступен - оставшиеся события уйдут при следующем проходе
+                    logger.exception("Не удалось отправить событие outbox %s", event.idempotency_key)
+                    break
+                dispatched.append(event.pk)
+
+        OutboxEvent.objects.filter(pk__in=dispatched).update(
+            dispatched_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+
+    return len(dispatched)
+
+
+def prune_outbox(days=None, batch_size=None):
+    # обработанное событие нужно только для отсева повторной доставки, которая приходит в пределах
+    # OUTBOX_REDELIVERY_TIMEOUT; старше срока хранения события удаляются короткими пачками
+    processed_before = timezone.now() - timedelta(days=days or settings.OUTBOX_RETENTION_DAYS)
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    pruned = 0
+    while True:
+        pks = list(
+            OutboxEvent.objects.filter(processed_at__lt=processed_before).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return pruned
+        pruned += OutboxEvent.objects.filter(pk__in=pks).delete()[0]
+
+
+def is_processed(event_key):
+    return OutboxEvent.objects.filter(idempotency_key=event_key, processed_at__isnull=False).exists()
+
+
+def mark_processed(event_key):
+    OutboxEvent.objects.filter(idempotency_key=event_key).update(processed_at=timezone.now())
@@ -0,0 +1,108 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(post, direction):
+    raw = json.dumps([direction, post.timestamp.isoformat(), post.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, timestamp, pk = json.loads(raw)
+        timestamp = datetime.fromisoformat(timestamp)
+    except (binascii.Error, ValueError, TypeError):
+        raise Http404("Некорректный курсор страницы")
+    if direction not in (NEXT, PREVIOUS) or not isinstance(pk, int):
+        raise Http404("Некорректный курсор страницы")
+    return direction, timestamp, pk
+
+
+def approximate_count(queryset):
+    # точный COUNT(*) по всему архиву дорогой; для подписи «примерно N» хватает значения из кэша
+    key = f'approx-count:{md5(str(queryset.query).encode(), usedforsecurity=False).hexdigest()}'
+    total = cache.get(key)
+    if total is None:
+        total = queryset.count()
+        cache.set(key, total, settings.PAGINATION_COUNT_TIMEOUT)
+    return total
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, approximate_total=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.approximate_total = approximate_total
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], NEXT)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], PREVIOUS)
+        return None
+
+
+class KeysetPaginationMixin:
+    """
+    Пагинация по курсору: страница ищется условием по (timestamp, id) вместо OFFSET и без COUNT(*).
+    Ссылки с ?page=N продолжают работать через обычный Paginator; без page лента открывается в режиме курсора.
+    """
+    cursor_kwarg = 'cursor'
+    keyset_approximate_total = True
+
+    def paginate_queryset(self, queryset, page_size):
+        self.cursor_page = None
+        if not self.use_keyset():
+            return super().paginate_queryset(queryset, page_size)
+
+        queryset = queryset.order_by('-timestamp', '-pk')
+        token = self.request.GET.get(self.cursor_kwarg)
+        if token:
+            direction, timestamp, pk = decode_cursor(token)
+        else:
+            direction, timestamp, pk = NEXT, None, None
+
+        if direction == NEXT:
+            page = queryset
+            if timestamp is not None:
+                # условие на timestamp вынесено отдельно, чтобы база шла по индексу, а не разбирала OR
+                page = page.filter(Q(timestamp__lte=timestamp), Q(timestamp__lt=timestamp) | Q(pk__lt=pk))
+            posts = list(page[:page_size + 1])
+            has_next, has_previous = len(posts) > page_size, timestamp is not None
+            posts = posts[:page_size]
+        else:
+            # назад по ленте - та же выборка в обратном порядке, затем разворот страницы
+            page = queryset.filter(Q(timestamp__gte=timestamp), Q(timestamp__gt=timestamp) | Q(pk__gt=pk))
+            posts = list(page.order_by('timestamp', 'pk')[:page_size + 1])
+            has_next, has_previous = True, len(posts) > page_size
+            posts = posts[:page_size][::-1]
+
+        total = approximate_count(queryset) if self.keyset_approximate_total else None
+        self.cursor_page = KeysetPage(posts, has_next, has_previous, total)
+        return None, self.cursor_page, posts, has_next or has_previous
+
+    def use_keyset(self):
+        return self.page_kwarg not in self.request.GET and self.page_kwarg not in self.kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cursor_page'] = getattr(self, 'cursor_page', None)
+        return context
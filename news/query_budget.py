@@ -0,0 +1,80 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    # бюджет функционального представления; у представлений-классов это атрибут query_budget
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    view_class = getattr(view_func, 'view_class', None)
+    return getattr(view_class or view_func, 'query_budget', None)
+
+
+class QueryPlanMixin:
+    # план загрузки связей объявляется в классе, а не размазывается по get_queryset и шаблонам
+    select_related = ()
+    prefetch_related = ()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к БД за весь запрос, включая рендеринг шаблона и остальные middleware,
+    и сравнивает с бюджетом представления. При превышении пишет предупреждение в лог,
+    а при QUERY_BUDGET_RAISE (включён под manage.py test) поднимает QueryBudgetExceeded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and len(counter.queries) > budget:
+            self.report(request, budget, counter.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_query_budget(view_func)
+        return None
+
+    def report(self, request, budget, queries):
+        message = f"{request.method} {request.path}: {len(queries)} запросов к БД при бюджете {budget}"
+        if settings.QUERY_BUDGET_RAISE:
+            raise QueryBudgetExceeded(message + '\n' + '\n'.join(queries))
+        logger.warning(message)
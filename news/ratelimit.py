@@ -0,0 +1,135 @@
+import math
+import time
+from datetime import datetime, timedelta, timezone
+
+from .cache_backends import has_atomic_counters, shared_cache
+
+SEEDING = 'seeding'
+READY = 'ready'
+
+
+class SlidingWindowLimit:
+    """
+    Не больше limit действий за последние window секунд, счётчики в общем кэше.
+    Окно делится на корзины по bucket секунд; действие сначала атомарно прибавляется к своей корзине
+    и только потом сравнивается сумма, поэтому два одновременных запроса не проходят оба сверх лимита.
+    Окно считается с запасом до одной корзины: лимит может держаться чуть дольше window, но не нарушается.
+    seed(ident, since) возвращает queryset времён уже совершённых действий - ими счётчик заполняется
+    при первом обращении, например после очистки кэша.
+    Если общий кэш не даёт атомарных счётчиков (файловый кэш без Redis), лимит с seed считается
+    по базе на каждый запрос: acquire() вызывается в транзакции, которая сохраняет действие, и сначала
+    берёт lock(ident) - блокировку строки, на которой одновременные запросы встают в очередь.
+    Лимит без seed считается в кэше приблизительно, одновременные запросы одного пользователя
+    могут его немного превысить.
+    """
+
+    def __init__(self, name, limit, window, bucket, seed=None, lock=None, cache=None, wait_timeout=2,
+                 poll_interval=0.05):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.bucket = bucket
+        self.seed = seed
+        self.lock = lock
+        self._cache = cache
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    @property
+    def cache(self):
+        return shared_cache(self._cache)
+
+    @property
+    def timeout(self):
+        return self.window + 2 * self.bucket
+
+    def bucket_key(self, ident, bucket):
+        return f'ratelimit:{self.name}:{ident}:{bucket}'
+
+    def marker_key(self, ident):
+        return f'ratelimit:{self.name}:{ident}:seeded'
+
+    def current_buckets(self):
+        last = int(time.time() // self.bucket)
+        return range(last - math.ceil(self.window / self.bucket), last + 1)
+
+    def ensure_seeded(self, ident):
+        if self.seed is None:
+            return
+        marker = self.marker_key(ident)
+        state = self.cache.get(marker)
+        if state == READY:
+            # отметка живёт дольше любой корзины, поэтому повторное заполнение не посчитает действия дважды
+            self.cache.touch(marker, self.timeout)
+            return
+        if state is None and self.cache.add(marker, SEEDING, self.wait_timeout * 5):
+            try:
+                self.fill(ident)
+            except Exception:
+                self.cache.delete(marker)
+                raise
+            self.cache.set(marker, READY, self.timeout)
+            return
+        # счётчик заполняет другой запрос: до готовности сумма была бы занижена
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline and self.cache.get(marker) != READY:
+            time.sleep(self.poll_interval)
+
+    def fill(self, ident):
+        buckets = self.current_buckets()
+        since = datetime.fromtimestamp(buckets[0] * self.bucket, tz=timezone.utc)
+        counts = {}
+        for moment in self.seed(ident, since):
+            bucket = int(moment.timestamp() // self.bucket)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        for bucket, count in counts.items():
+            self.incr(self.bucket_key(ident, bucket), count)
+
+    def incr(self, key, delta):
+        self.cache.add(key, 0, self.timeout)
+        return self.cache.incr(key, delta)
+
+    @property
+    def counts_in_database(self):
+        return self.seed is not None and not has_atomic_counters(self.cache)
+
+    def database_count(self, ident):
+        since = datetime.now(tz=timezone.utc) - timedelta(seconds=self.window)
+        return self.seed(ident, since).count()
+
+    def count(self, ident):
+        if self.counts_in_database:
+            return self.database_count(ident)
+        self.ensure_seeded(ident)
+        keys = [self.bucket_key(ident, bucket) for bucket in self.current_buckets()]
+        return sum(self.cache.get_many(keys).values())
+
+    def remaining(self, ident):
+        return max(self.limit - self.count(ident), 0)
+
+    def acquire(self, ident):
+        """Занимает место в окне. Возвращает корзину для release() или None, если лимит исчерпан."""
+        if self.counts_in_database:
+            # место занимает само действие, сохранённое в базе; release() тогда ничего не делает.
+            # Блокировка держится до коммита, поэтому следующий запрос посчитает уже сохранённое действие
+            if self.lock is not None:
+                self.lock(ident)
+            return self.current_buckets()[-1] if self.database_count(ident) < self.limit else None
+        self.ensure_seeded(ident)
+        buckets = self.current_buckets()
+        key = self.bucket_key(ident, buckets[-1])
+        self.incr(key, 1)
+        keys = [self.bucket_key(ident, bucket) for bucket in buckets]
+        if sum(self.cache.get_many(keys).values()) > self.limit:
+            self.cache.decr(key, 1)
+            return None
+        return buckets[-1]
+
+    def release(self, ident, bucket):
+        # действие не состоялось (форма с ошибками, откат транзакции) - место возвращается
+        if self.counts_in_database:
+            return
+        try:
+            self.cache.decr(self.bucket_key(ident, bucket), 1)
+        except ValueError:
+            pass
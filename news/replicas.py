@@ -0,0 +1,169 @@
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+PG_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+# alias -> (когда измерено, отставание в секундах); у каждого процесса свои измерения
+_measured = {}
+
+
+class ReadState:
+    def __init__(self, alias=None, pinned=False, pin_on_write=True):
+        self.alias = alias
+        self.pinned = pinned
+        self.pin_on_write = pin_on_write
+        self.wrote = False
+
+
+_state = ContextVar('news_replica_state', default=None)
+
+
+def measure_lag(alias):
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(PG_LAG_SQL)
+            return float(cursor.fetchone()[0] or 0)
+    if connection.vendor == 'sqlite':
+        # локальная проверка на двух файлах: реплика - копия основной базы, отставание считается
+        # с момента её обновления, если основная база менялась позже
+        primary = os.path.getmtime(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'])
+        replica = os.path.getmtime(connection.settings_dict['NAME'])
+        return 0.0 if replica >= primary else time.time() - replica
+    return 0.0
+
+
+def replica_lag(alias):
+    now = time.time()
+    checked_at, lag = _measured.get(alias, (0, None))
+    if lag is None or now - checked_at >= settings.DB_REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            lag = measure_lag(alias)
+        except (DatabaseError, OSError) as e:
+            # недоступная реплика исключается до следующей проверки
+            logger.warning(f"Реплика {alias} недоступна: {e}")
+            lag = float('inf')
+        checked_at = now
+        _measured[alias] = (checked_at, lag)
+    # с момента измерения реплика могла отстать ещё сильнее
+    return lag + (now - checked_at)
+
+
+def choose_replica():
+    """
+    Случайная реплика из тех, что отстают не больше DB_REPLICA_MAX_LAG по собственной позиции
+    воспроизведения. Свои изменения клиент видит благодаря PIN_COOKIE, а страницу, прочитанную
+    с реплики во время отставания, кэш держит недолго (TaggedCacheMiddleware). None - читать основную базу.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return None
+    candidates = [alias for alias in settings.DATABASE_REPLICAS if replica_lag(alias) <= settings.DB_REPLICA_MAX_LAG]
+    return random.choice(candidates) if candidates else None
+
+
+@contextmanager
+def replica_reads(pin_on_write=True):
+    """
+    Чтения внутри блока идут на реплику. После первой записи блок читает основную базу,
+    чтобы видеть свои изменения; pin_on_write=False оставляет реплику для задач, которые
+    пишут одно, а читают другое.
+    """
+    state = _state.get()
+    if state is None:
+        state = ReadState()
+        token = _state.set(state)
+    else:
+        token = None
+    previous = state.alias, state.pin_on_write
+    if not state.pinned:
+        state.alias = choose_replica()
+        state.pin_on_write = pin_on_write
+    try:
+        yield state.alias
+    finally:
+        state.alias, state.pin_on_write = previous
+        if token is not None:
+            _state.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.alias is None:
+            return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+            if state.pin_on_write:
+                state.alias = None
+                state.pinned = True
+        # явно: иначе Django пишет объект в ту базу, из которой он был прочитан
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Запрос, который писал в базу, и следующие запросы того же клиента в течение
+    DB_REPLICA_PIN_SECONDS читают основную базу: пользователь сразу видит свои изменения,
+    пока реплики их догоняют.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        state = ReadState(pinned=PIN_COOKIE in request.COOKIES or request.method not in SAFE_METHODS)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+
+        if state.wrote or request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.DB_REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    # чтения представления идут на реплику; страницу из кэша mixin не затрагивает
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads() as alias:
+            response = super().dispatch(request, *args, **kwargs)
+            # шаблон тоже читает базу, поэтому рендерится внутри блока, а не после выхода из представления
+            if hasattr(response, 'render'):
+                response.render()
+        if alias is not None:
+            # на сколько данные страницы могут отставать от основной базы
+            request._replica_lag = replica_lag(alias)
+        return response
@@ -0,0 +1,138 @@
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import bump_tags
+from .models import Author, Comment, Post, PostCategory
+from .votes import pending_votes
+
+POST_FIELDS = ['id', 'author_id', 'post_type', 'title', 'content', 'rating', 'timestamp', 'updated_at']
+COMMENT_FIELDS = ['id', 'post_id', 'user_id', 'text', 'timestamp', 'rating']
+
+
+def retention_cutoff(days):
+    return timezone.now() - timedelta(days=days)
+
+
+def expired_posts(cutoff):
+    return Post.objects.filter(timestamp__lt=cutoff)
+
+
+def next_batch(cutoff, after, batch_size):
+    # пачка - следующие по первичному ключу посты старше границы, без OFFSET и без чтения всех id сразу
+    return list(
+        expired_posts(cutoff).filter(pk__gt=after).order_by('pk').values_list('pk', flat=True)[:batch_size]
+    )
+
+
+def delete_rows(model, column, ids):
+    # DELETE по списку id без загрузки объектов: ORM-каскад читал бы каждую строку и отправлял сигналы
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {connection.ops.quote_name(column)} IN ({placeholders})', ids)
+        return cursor.rowcount
+
+
+class PostArchive:
+    """
+    Архив в файле JSONL, сжатом gzip: одна строка на пост вместе с его категориями и комментариями.
+    Пачка сбрасывается на диск до удаления строк из базы, поэтому сбой между записью и коммитом
+    оставляет в архиве лишнюю копию пачки, но не теряет посты.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+
+    def write(self, records):
+        for record in records:
+            self.file.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def archive_batch(post_ids, archive=None):
+    """
+    Переносит посты в архив и удаляет их вместе с комментариями и связями с категориями.
+    Возвращает (постов, комментариев) - сколько удалено.
+    """
+    with transaction.atomic():
+        # блокировка постов не даёт добавить к ним комментарий, пока пачка читается и удаляется
+        posts = list(Post.objects.select_for_update().filter(pk__in=post_ids).order_by('pk').values(*POST_FIELDS))
+        if not posts:
+            return 0, 0
+        post_ids = [post['id'] for post in posts]
+        comments = list(Comment.objects.filter(post_id__in=post_ids).order_by('pk').values(*COMMENT_FIELDS))
+        links = PostCategory.objects.filter(post_id__in=post_ids).values_list('post_id', 'category_id')
+
+        categories = defaultdict(list)
+        for post_id, category_id in links:
+            categories[post_id].append(category_id)
+        post_comments = defaultdict(list)
+        for comment in comments:
+            post_comments[comment['post_id']].append(comment)
+
+        if archive is not None:
+            archive.write(
+                {**post, 'categories': categories[post['id']], 'comments': post_comments[post['id']]}
+                for post in posts
+            )
+
+        # комментарии удаляются по тому же ограниченному списку постов, что и связи с категориями:
+        # список id всех комментариев пачки мог бы превысить лимит параметров SQLite. Удаляются ровно
+        # заархивированные: в Postgres комментарий к заблокированному посту не добавить, а в SQLite запись
+        # после чужого коммита не пройдёт (database is locked), и пачка повторится при следующем запуске
+        deleted_comments = delete_rows(Comment, 'post_id', post_ids)
+        delete_rows(PostCategory, 'post_id', post_ids)
+        deleted_posts = delete_rows(Post, 'id', post_ids)
+
+        subtract_ratings(posts, comments)
+
+        tags = ['posts', *(f'post-{pk}' for pk in post_ids)]
+        tags += [f'author-{pk}' for pk in {post['author_id'] for post in posts}]
+        tags += [f'category-{pk}' for pk in {pk for ids in categories.values() for pk in ids}]
+        transaction.on_commit(lambda: invalidate(post_ids, tags))
+    return deleted_posts, deleted_comments
+
+
+def subtract_ratings(posts, comments):
+    # рейтинг удаляемых постов и их комментариев уходит из рейтинга авторов, по обновлению на автора;
+    # так же вычитает рейтинг сигнал удаления поста в news.signals
+    post_ratings = pending_votes('post', [post['id'] for post in posts])
+    comment_ratings = pending_votes('comment', [comment['id'] for comment in comments])
+    post_authors = {post['id']: post['author_id'] for post in posts}
+
+    deltas = defaultdict(lambda: defaultdict(float))
+    for post in posts:
+        deltas[post['author_id']]['post'] -= post['rating'] + post_ratings.get(post['id'], 0)
+    for comment in comments:
+        rating = comment['rating'] + comment_ratings.get(comment['id'], 0)
+        deltas[comment['user_id']]['comment'] -= rating
+        deltas[post_authors[comment['post_id']]]['post_comments'] -= rating
+
+    for author_id, fields in deltas.items():
+        if any(fields.values()):
+            Author.add_rating(author_id, **fields)
+
+
+def invalidate(post_ids, tags):
+    cache.delete_many([f'post-{pk}' for pk in post_ids])
+    bump_tags(*tags)
@@ -0,0 +1,185 @@
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+WORD_RE = re.compile(r'\w+')
+MAX_TERMS = 10
+
+FTS_TABLE = 'news_post_fts'
+PG_INDEX = 'news_post_search_idx'
+
+# окончания отрезаются от длинных к коротким, основа при этом остаётся не короче MIN_STEM букв
+RUSSIAN_ENDINGS = {
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ей', 'ов', 'ев', 'ам', 'ям', 'ом', 'ем',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ый', 'ий', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю',
+    'ать', 'ять', 'ить', 'еть', 'ешь', 'ишь', 'ете', 'ите', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ла', 'ло', 'ли',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+}
+ENDING_LENGTHS = sorted({len(ending) for ending in RUSSIAN_ENDINGS}, reverse=True)
+MIN_STEM = 4
+
+# триггеры на чистом SQL: в news_post может писать любое соединение, включая dbshell и консоль sqlite3
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON news_post BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END""",
+    f'{FTS_TABLE}_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON news_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END""",
+    f'{FTS_TABLE}_update': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF title, content ON news_post BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+        END""",
+}
+
+
+def search_terms(query):
+    return WORD_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def stem(word):
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM and word[-length:] in RUSSIAN_ENDINGS:
+            return word[:-length]
+    return word
+
+
+def post_search_vector():
+    # выражение запроса совпадает с выражением индекса, иначе Postgres не использует GIN
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('title', weight='A', config='russian') + SearchVector('content', weight='B', config='russian')
+
+
+class SearchBackend:
+    """
+    Полнотекстовый поиск по заголовку и тексту поста. search() фильтрует queryset и упорядочивает его
+    по релевантности; install()/uninstall() создают и удаляют индекс, их вызывает миграция.
+    Фильтры по дате и автору применяются ко всем совпадениям, а не к части самых новых.
+    """
+
+    def install(self, connection):
+        pass
+
+    def uninstall(self, connection):
+        pass
+
+    def repair(self, connection):
+        pass
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class BasicSearchBackend(SearchBackend):
+    # запасной вариант для баз без полнотекстового индекса: LIKE по каждому слову, без ранжирования
+    def search(self, queryset, query):
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(content__icontains=term)
+        return queryset.filter(condition).order_by('-timestamp')
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    FTS5-таблица без собственного содержимого, синхронизируется триггерами на вставку, изменение и удаление.
+    Русского стеммера в FTS5 нет: в индексе слова как есть, а запрос ищет основу слова как префикс
+    ("новостями" -> новост*). Заголовок весит в bm25 больше текста.
+    """
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"title, content, content='', tokenize='unicode61')"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')")
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, title, content) '
+                f'SELECT id, title, content FROM news_post'
+            )
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def repair(self, connection):
+        # SQLite пересоздаёт таблицу при AlterField, и триггеры на news_post пропадают вместе со старой таблицей
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone() is None:
+                return
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'news_post'")
+            existing = {row[0] for row in cursor.fetchall()}
+        if not existing.issuperset(SQLITE_TRIGGERS):
+            self.install(connection)
+
+    def match_expression(self, query):
+        return ' '.join(f'"{stem(term)}"*' for term in search_terms(query))
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        # bm25 считается только внутри запроса с MATCH: по строке индекса для каждого найденного поста
+        rank = RawSQL(
+            f'SELECT bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {queryset.model._meta.db_table}.id',
+            [match],
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('search_rank', '-timestamp')
+
+
+class PostgresSearchBackend(SearchBackend):
+    # tsvector по словарю russian (стемминг Snowball) и GIN-индекс по тому же выражению
+    def install(self, connection):
+        from django.contrib.postgres.indexes import GinIndex
+
+        from .models import Post
+
+        index = GinIndex(post_search_vector(), name=PG_INDEX)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+            cursor.execute(str(index.create_sql(Post, connection.schema_editor())))
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        if not search_terms(query):
+            return queryset.none()
+        search_query = SearchQuery(query, config='russian', search_type='websearch')
+        return queryset.annotate(
+            search_vector=post_search_vector(),
+            search_rank=SearchRank(post_search_vector(), search_query, cover_density=True),
+        ).filter(search_vector=search_query).order_by('-search_rank', '-timestamp')
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(connection):
+    # NEWS_SEARCH_BACKEND задаёт свой класс, иначе бэкенд выбирается по базе данных
+    if settings.NEWS_SEARCH_BACKEND:
+        return import_string(settings.NEWS_SEARCH_BACKEND)()
+    return BACKENDS.get(connection.vendor, BasicSearchBackend)()
@@ -1,9 +1,144 @@
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Post
-from .tasks import send_new_post_notification
+from django.utils import timezone
+from .caching import bump_tags
+from .models import Author, Category, Comment, Post, PostCategory
+from .outbox import record_post_created
+from .retention import subtract_ratings
+
+User = get_user_model()
+
+
+def bump_on_commit(*tags):
+    # до коммита параллельный запрос может закэшировать старые данные уже с новой версией тега
+    transaction.on_commit(lambda: bump_tags(*tags))
+
+
+def touch_posts(post_ids):
+    # категории выводятся на странице поста, поэтому их смена должна менять Last-Modified/ETag поста
+    Post.objects.filter(pk__in=post_ids).update(updated_at=timezone.now())
+
 
 @receiver(post_save, sender=Post)
 def post_created_handler(sender, instance, created, **kwargs):
     if created:
-        send_new_post_notification.delay(instance.id)
+        # событие пишется в той же транзакции, что и пост; в брокер его отправит relay_outbox
+        record_post_created(instance)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    cache.delete(f'post-{instance.pk}')
+    bump_on_commit(f'post-{instance.pk}', f'author-{instance.author_id}', 'posts')
+
+
+# like()/dislike() копят голоса в news.votes; здесь учитываются только появление и удаление
+# оценённых постов и комментариев. При удалении вычитаются и несброшенные голоса: их доля в рейтинге
+# автора всё равно придёт со следующим flush_votes. Пост со всеми комментариями вычитается
+# до удаления, одним обновлением на каждого автора, а не сигналом на каждый комментарий
+@receiver(post_save, sender=Post)
+def add_post_rating(sender, instance, created, **kwargs):
+    if created and instance.rating:
+        Author.add_rating(instance.author_id, post=instance.rating)
+
+
+def deleted_with_post(origin):
+    # комментарии удаляются каскадом от поста: их рейтинг уже вычтен одним обновлением на автора
+    if isinstance(origin, QuerySet):
+        return origin.model is Post
+    return isinstance(origin, Post)
+
+
+@receiver(pre_delete, sender=Post)
+def remove_post_rating(sender, instance, origin=None, **kwargs):
+    post = {'id': instance.pk, 'author_id': instance.author_id, 'rating': instance.rating}
+    comments = []
+    if deleted_with_post(origin):
+        comments = list(instance.comments.values('id', 'post_id', 'user_id', 'rating'))
+    subtract_ratings([post], comments)
+
+
+@receiver(post_save, sender=Comment)
+def add_comment_rating(sender, instance, created, **kwargs):
+    if created and instance.rating:
+        instance.add_author_rating(instance.rating)
+
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_rating(sender, instance, origin=None, **kwargs):
+    if deleted_with_post(origin):
+        return
+    rating = instance.current_rating
+    if rating:
+        instance.add_author_rating(-rating)
+
+
+@receiver(post_save, sender=PostCategory)
+@receiver(post_delete, sender=PostCategory)
+def invalidate_post_category(sender, instance, **kwargs):
+    touch_posts([instance.post_id])
+    bump_on_commit(f'post-{instance.post_id}', f'category-{instance.category_id}', 'posts')
+
+
+@receiver(m2m_changed, sender=PostCategory)
+def invalidate_post_categories(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # после очистки уже не узнать, какие связи были
+        related = instance.category_posts if reverse else instance.post_categories
+        pk_set = set(related.values_list('post_id' if reverse else 'category_id', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        touch_posts(pk_set)
+        tags = [f'category-{instance.pk}'] + [f'post-{pk}' for pk in pk_set]
+    else:
+        touch_posts([instance.pk])
+        tags = [f'post-{instance.pk}'] + [f'category-{pk}' for pk in pk_set]
+    bump_on_commit('posts', *tags)
+
+
+@receiver(m2m_changed, sender=Category.subscribers.through)
+def invalidate_category_subscribers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bump_on_commit(*[f'category-{pk}' for pk in pk_set or ()])
+    else:
+        bump_on_commit(f'category-{instance.pk}')
+
+
+@receiver(m2m_changed, sender=Author.subscribers.through)
+def invalidate_author_subscribers(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bump_on_commit(*[f'author-{pk}' for pk in pk_set or ()])
+    else:
+        bump_on_commit(f'author-{instance.pk}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    bump_on_commit('categories', f'category-{instance.pk}')
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author(sender, instance, **kwargs):
+    bump_on_commit('authors', f'author-{instance.pk}')
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_name(sender, instance, created, update_fields=None, **kwargs):
+    # имя автора выводится в списках постов; вход обновляет только last_login и страниц не трогает
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    if Author.objects.filter(pk=instance.pk).exists():
+        bump_on_commit('authors', f'author-{instance.pk}')
@@ -1,73 +1,171 @@
-from datetime import timedelta
-from celery import shared_task
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+import logging
+
+from celery import group, shared_task
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.db.models import F
 from django.utils import timezone
-from .models import Post, Category
+from . import outbox, votes
+from .digest import send_weekly_digest
+from .models import NewsletterShard, NewsletterRun, Post
+from .newsletter import start_newsletter_run
+from .notifications import (
+    chunked, get_batch_size, get_post_recipients, get_posts_recipients, get_subscribed_posts,
+    prepare_imported_posts_notification, prepare_post_notification,
+)
+from .replicas import replica_reads
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+@shared_task
+def relay_outbox():
+    return outbox.relay_outbox()
+
+
+@shared_task
+def prune_outbox():
+    return outbox.prune_outbox()
+
+
+@shared_task
+def flush_votes():
+    return votes.flush_votes()
+
+
+@shared_task
+def send_new_post_notification(post_id, event_key=None):
+    if event_key and outbox.is_processed(event_key):
+        return 0
+
+    post = Post.objects.filter(pk=post_id).first()
+    batches = []
+    if post is not None:
+        recipient_ids = get_post_recipients(post).values_list('pk', flat=True)
+        batches = list(chunked(recipient_ids.iterator(), get_batch_size()))
+    if batches:
+        group(send_post_notification_batch.s(post_id, batch) for batch in batches).apply_async()
+
+    if event_key:
+        outbox.mark_processed(event_key)
+    return len(batches)
 
 
 @shared_task
-def send_new_post_notification(post_id):
-    post = Post.objects.get(pk=post_id)
-    categories = post.category.all()
-    subscribers = set()
+def send_post_notification_batch(post_id, user_ids):
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return 0
 
-    for category in categories:
-        for user in category.subscribers.all():
-            if user.email:
-                subscribers.add(user)
+    users = User.objects.filter(pk__in=user_ids).exclude(email='').only('username', 'email')
 
     subject = f'Новая статья: {post.title}'
     from_email = settings.DEFAULT_FROM_EMAIL
+    prepared = prepare_post_notification(post)
+    connection = get_connection()
+    messages = []
+
+    for user in users:
+        text_content, html_content = prepared.render(user.username)
 
-    for user in subscribers:
-        html_content = render_to_string(
-            'news/post_notification.html',
-            {
-                'username': user.username,
-                'post': post,
-                'post_url': f"http://127.0.0.1:8000{post.get_absolute_url()}",
-            }
-        )
-        text_content = f"Здравствуй, {user.username}. Новая статья: {post.title}\n\n{post.content[:100]}..."
-
-        msg = EmailMultiAlternatives(subject, text_content, from_email, [user.email])
+        msg = EmailMultiAlternatives(subject, text_content, from_email, [user.email], connection=connection)
         msg.attach_alternative(html_content, "text/html")
-        msg.send()
+        messages.append(msg)
+
+    return connection.send_messages(messages)
 
 
 @shared_task
-def send_weekly_newsletter():
-    today = timezone.now()
-    last_week = today - timedelta(days=7)
+def send_imported_posts_notification(post_ids, event_key=None):
+    if event_key and outbox.is_processed(event_key):
+        return 0
 
-    for category in Category.objects.all():
-        posts = Post.objects.filter(category=category, timestamp__gte=last_week)
-        if not posts.exists():
+    recipient_ids = get_posts_recipients(post_ids).values_list('pk', flat=True)
+    batches = list(chunked(recipient_ids.iterator(), get_batch_size()))
+    if batches:
+        group(send_imported_posts_batch.s(post_ids, batch) for batch in batches).apply_async()
+
+    if event_key:
+        outbox.mark_processed(event_key)
+    return len(batches)
+
+
+@shared_task
+def send_imported_posts_batch(post_ids, user_ids):
+    posts = Post.objects.filter(pk__in=post_ids).only('id', 'title', 'timestamp').in_bulk()
+    subscribed = get_subscribed_posts(post_ids, user_ids)
+    users = User.objects.filter(pk__in=subscribed).exclude(email='').only('username', 'email')
+
+    subject = 'Новые публикации по вашим подпискам'
+    from_email = settings.DEFAULT_FROM_EMAIL
+    prepared = {}
+    connection = get_connection()
+    messages = []
+
+    for user in users:
+        user_posts = [posts[pk] for pk in subscribed[user.pk] if pk in posts]
+        if not user_posts:
             continue
+        # у подписчиков одних и тех же категорий письмо рендерится один раз
+        key = tuple(post.pk for post in user_posts)
+        if key not in prepared:
+            prepared[key] = prepare_imported_posts_notification(user_posts)
+        text_content, html_content = prepared[key].render(user.username)
 
-        for user in category.subscribers.all():
-            if not user.email:
-                continue
-
-            html_content = render_to_string(
-                'news/weekly_newsletter.html',
-                {
-                    'category': category,
-                    'posts': posts,
-                    'username': user.username,
-                    'site_url': 'http://127.0.0.1:8000'
-                }
-            )
-            subject = f'Новые статьи в категории "{category.name}" за неделю'
-            from_email = settings.DEFAULT_FROM_EMAIL
-
-            msg = EmailMultiAlternatives(
-                subject=subject,
-                body=f'Здравствуйте, {user.username}. Посмотрите новые статьи за неделю.',
-                from_email=from_email,
-                to=[user.email],
+        msg = EmailMultiAlternatives(subject, text_content, from_email, [user.email], connection=connection)
+        msg.attach_alternative(html_content, "text/html")
+        messages.append(msg)
+
+    return connection.send_messages(messages)
+
+
+@shared_task
+def send_weekly_newsletter():
+    return start_newsletter_run().pk
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def send_newsletter_shard(self, shard_id):
+    shard = NewsletterShard.objects.select_related('run').get(pk=shard_id)
+    if shard.status in (NewsletterShard.DONE, NewsletterShard.FAILED):
+        return shard.sent
+    shards = NewsletterShard.objects.filter(pk=shard_id)
+    # попытки считаются и тогда, когда воркер падает посреди шарда и задача приходит снова (acks_late)
+    if shard.attempts >= settings.NEWSLETTER_SHARD_MAX_ATTEMPTS:
+        shards.update(status=NewsletterShard.FAILED, finished_at=timezone.now())
+        return 0
+
+    shards.update(status=NewsletterShard.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+    try:
+        # подписки и посты читаются с реплики; водяные отметки пишутся в основную базу
+        with replica_reads(pin_on_write=False):
+            sent = send_weekly_digest(
+                shard.run.period_start,
+                shard.run.period_end,
+                user_range=(shard.first_user_id, shard.last_user_id),
             )
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
+    except Exception as e:
+        # исключение из шарда не дало бы сработать chord: последняя неудача помечает шард ошибкой.
+        # Кому письмо не ушло, получит посты в следующей рассылке - водяная отметка у него не сдвинулась
+        if shard.attempts + 1 >= settings.NEWSLETTER_SHARD_MAX_ATTEMPTS:
+            logger.exception(f"Шард рассылки {shard_id} не отправлен")
+            shards.update(status=NewsletterShard.FAILED, finished_at=timezone.now())
+            return 0
+        shards.update(status=NewsletterShard.PENDING)
+        raise self.retry(exc=e, countdown=60 * 2 ** shard.attempts)
+    shards.update(
+        status=NewsletterShard.DONE,
+        sent=sent,
+        finished_at=timezone.now(),
+    )
+    return sent
+
+
+@shared_task
+def finish_newsletter_run(run_id):
+    NewsletterRun.objects.filter(pk=run_id, finished_at__isnull=True).exclude(
+        shards__status__in=[NewsletterShard.PENDING, NewsletterShard.RUNNING],
+    ).update(finished_at=timezone.now())
@@ -13,5 +13,8 @@ def current_time(format_string='%b %d %Y'):
 def url_replace(context, **kwargs):
     d = context['request'].GET.copy()
     for key, value in kwargs.items():
-        d[key] = value
+        if value is None:
+            d.pop(key, None)
+        else:
+            d[key] = value
     return d.urlencode()
\ No newline at end of file
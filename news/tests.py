@@ -1 +1,849 @@
-# Create your tests here.
+import gzip
+import io
+import json
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from aiosmtpd.controller import Controller
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from DjangoProjectNewsPortal.celery import app
+from news import outbox, replicas, votes
+from news.benchmarks import seed
+from news.cache_backends import shared_cache
+from news.caching import LAST_BUMP_KEY, TaggedCacheMiddleware, bump_tags
+from news.digest import send_each, send_weekly_digest
+from news.filters import NewsFilter
+from news.management.commands.import_posts import Command
+from news.mail import PooledEmailBackend, _process_state, is_transient
+from news.models import (
+    Author, Category, Comment, NewsletterRun, NewsletterShard, OutboxEvent, Post, PostCategory,
+)
+from news.newsletter import start_newsletter_run
+from news.notifications import get_post_recipients, get_posts_recipients
+from news.ratelimit import SlidingWindowLimit
+from news.replicas import ReplicaMiddleware, ReplicaRouter, replica_reads
+from news.retention import PostArchive, archive_batch
+from news.tasks import finish_newsletter_run, send_new_post_notification, send_newsletter_shard
+from news.views import author_post_times, post_limit, subscription_limit
+
+
+class VoteFlushTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.reader = User.objects.create(username='reader')
+        self.post = Post.objects.create(author=self.author, title='Пост', content='Текст')
+        self.comment = Comment.objects.create(post=self.post, user=self.reader, text='Комментарий')
+
+    def assertRatings(self, post, comment, author):
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual((self.post.rating, self.comment.rating, self.author.rating), (post, comment, author))
+
+    def test_votes_are_buffered_until_flush(self):
+        self.post.like()
+        self.post.like()
+        self.comment.dislike()
+
+        self.assertRatings(0, 0, 0)
+        self.assertEqual(self.post.current_rating, 2)
+        self.assertEqual(self.author.current_rating, 2 * votes.POST_RATING_WEIGHT - 1)
+
+        self.assertEqual(votes.flush_votes(), 5)
+        self.assertRatings(2, -1, 2 * votes.POST_RATING_WEIGHT - 1)
+        self.assertEqual(self.post.current_rating, 2)
+        self.assertEqual(votes.flush_votes(), 0)
+
+    def test_object_returns_to_journal_after_flush(self):
+        self.post.like()
+        votes.flush_votes()
+        self.post.like()
+
+        self.assertEqual(votes.flush_votes(), 2)
+        self.assertRatings(2, 0, 2 * votes.POST_RATING_WEIGHT)
+
+    def test_duplicate_journal_entries_are_applied_once(self):
+        self.post.like()
+        # отметка в журнале истекла до сброса: объект записывается в журнал второй раз
+        shared_cache().delete(votes.dirty_key('post', self.post.pk))
+        self.post.like()
+
+        votes.flush_votes()
+        self.assertRatings(2, 0, 2 * votes.POST_RATING_WEIGHT)
+
+    def test_unwritten_journal_position_is_reread_by_next_flush(self):
+        self.post.like()
+        # позиция выдана, но запись журнала ещё не сделана
+        position = votes.increment(shared_cache(), votes.JOURNAL_SEQ_KEY, 1)
+        self.comment.like()
+
+        votes.flush_votes()
+        self.assertEqual(shared_cache().get(votes.JOURNAL_FLUSHED_KEY), position - 1)
+
+        shared_cache().set(votes.journal_key(position), ('comment', self.comment.pk))
+        self.comment.like()
+        votes.flush_votes()
+        self.assertRatings(1, 2, votes.POST_RATING_WEIGHT + 2)
+
+    def test_concurrent_flush_waits_for_lock(self):
+        self.post.like()
+        shared_cache().add(votes.FLUSH_LOCK_KEY, 1)
+
+        self.assertEqual(votes.flush_votes(), 0)
+        self.assertRatings(0, 0, 0)
+        self.assertEqual(self.post.current_rating, 1)
+
+        shared_cache().delete(votes.FLUSH_LOCK_KEY)
+        self.assertEqual(votes.flush_votes(), 2)
+        self.assertRatings(1, 0, votes.POST_RATING_WEIGHT)
+
+    def test_flush_from_another_thread_skips_while_locked(self):
+        write_deltas = votes.write_deltas
+        results = []
+
+        def flush_concurrently(taken):
+            # второй сброс запускается, пока первый держит блокировку и пишет в базу
+            thread = threading.Thread(target=lambda: results.append(votes.flush_votes()))
+            thread.start()
+            thread.join()
+            write_deltas(taken)
+
+        self.post.like()
+        with mock.patch('news.votes.write_deltas', side_effect=flush_concurrently):
+            self.assertEqual(votes.flush_votes(), 2)
+        self.assertEqual(results, [0])
+        self.assertRatings(1, 0, votes.POST_RATING_WEIGHT)
+
+    def test_vote_during_flush_is_not_lost(self):
+        write_deltas = votes.write_deltas
+
+        def vote_while_writing(taken):
+            self.post.like()
+            write_deltas(taken)
+
+        self.post.like()
+        with mock.patch('news.votes.write_deltas', side_effect=vote_while_writing):
+            votes.flush_votes()
+        self.assertRatings(1, 0, votes.POST_RATING_WEIGHT)
+
+        votes.flush_votes()
+        self.assertRatings(2, 0, 2 * votes.POST_RATING_WEIGHT)
+
+    def test_failed_write_returns_votes_to_counters(self):
+        self.post.like()
+        with mock.patch('news.votes.write_deltas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                votes.flush_votes()
+        self.assertEqual(self.post.current_rating, 1)
+        self.assertIsNone(shared_cache().get(votes.FLUSH_LOCK_KEY))
+
+        votes.flush_votes()
+        self.assertRatings(1, 0, votes.POST_RATING_WEIGHT)
+
+    def test_votes_are_written_directly_without_atomic_counters(self):
+        with mock.patch('news.votes.has_atomic_counters', return_value=False):
+            self.post.like()
+            self.comment.like()
+            self.assertRatings(1, 1, votes.POST_RATING_WEIGHT + 1)
+            self.assertEqual(votes.flush_votes(), 0)
+
+
+class SlidingWindowLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.limit = SlidingWindowLimit('test-posts', 2, window=60 * 60, bucket=60, seed=author_post_times)
+
+    def test_limit_is_seeded_from_database(self):
+        Post.objects.create(author=self.author, title='Пост', content='Текст')
+        self.assertEqual(self.limit.count(self.author.pk), 1)
+        self.assertIsNotNone(self.limit.acquire(self.author.pk))
+        self.assertIsNone(self.limit.acquire(self.author.pk))
+
+    def test_release_returns_place(self):
+        bucket = self.limit.acquire(self.author.pk)
+        self.limit.release(self.author.pk, bucket)
+        self.assertEqual(self.limit.count(self.author.pk), 0)
+
+    def test_database_limit_locks_before_counting(self):
+        lock = mock.Mock()
+        self.limit.lock = lock
+        Post.objects.create(author=self.author, title='Пост', content='Текст')
+        with mock.patch('news.ratelimit.has_atomic_counters', return_value=False):
+            # одна блокировка (здесь заглушка) и один COUNT, без чтения всех времён публикаций
+            with self.assertNumQueries(1):
+                self.assertIsNotNone(self.limit.acquire(self.author.pk))
+        lock.assert_called_once_with(self.author.pk)
+
+    def test_post_limit_locks_author_row_in_database_mode(self):
+        with mock.patch('news.ratelimit.has_atomic_counters', return_value=False):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertIsNotNone(post_limit.acquire(self.author.pk))
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"news_author"', queries[0]['sql'])
+        self.assertIn('COUNT', queries[1]['sql'])
+
+    def test_counts_in_database_without_atomic_counters(self):
+        with mock.patch('news.ratelimit.has_atomic_counters', return_value=False):
+            self.assertIsNotNone(self.limit.acquire(self.author.pk))
+            Post.objects.create(author=self.author, title='Первый', content='Текст')
+            Post.objects.create(author=self.author, title='Второй', content='Текст')
+            self.assertEqual(self.limit.count(self.author.pk), 2)
+            self.assertIsNone(self.limit.acquire(self.author.pk))
+        # счётчики кэша база не трогала
+        self.assertIsNone(shared_cache().get(self.limit.marker_key(self.author.pk)))
+
+
+class CreatePostLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+        self.user.user_permissions.add(Permission.objects.get(codename='add_post'))
+        Author.objects.create(user=self.user)
+        self.category = Category.objects.create(name='Политика')
+        self.client.force_login(self.user)
+
+    def create(self, title):
+        return self.client.post(
+            reverse('news_create'),
+            {'post_type': 'news', 'title': title, 'content': 'Текст', 'category': [self.category.pk]},
+        )
+
+    def test_limit_is_counted_in_database_without_atomic_counters(self):
+        with mock.patch('news.ratelimit.has_atomic_counters', return_value=False), \
+                mock.patch.object(post_limit, 'limit', 1):
+            self.assertEqual(self.create('').status_code, 200)
+            self.assertRedirects(self.create('Первый'), reverse('post_detail', args=[Post.objects.get().pk]))
+            self.create('Второй')
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Первый'])
+
+
+class SubscriptionLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.category = Category.objects.create(name='Политика')
+        self.client.force_login(self.user)
+
+    def test_unknown_action_does_not_use_quota(self):
+        self.client.post(reverse('subscription', args=['follow', 'category', self.category.pk]))
+        self.assertEqual(subscription_limit.count(self.user.pk), 0)
+
+        self.client.post(reverse('subscription', args=['subscribe', 'category', self.category.pk]))
+        self.assertEqual(subscription_limit.count(self.user.pk), 1)
+        self.assertTrue(self.category.subscribers.filter(pk=self.user.pk).exists())
+
+
+class PostDeleteRatingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_post'))
+        self.author = Author.objects.create(user=self.user)
+        self.commenter = Author.objects.create(user=User.objects.create(username='commenter'))
+        self.post = Post.objects.create(author=self.author, post_type=Post.NEWS, title='Пост', content='Текст', rating=3)
+        for number in range(10):
+            Comment.objects.create(post=self.post, user=self.commenter.user, text=f'Комментарий {number}', rating=1)
+        Author.objects.filter(pk=self.author.pk).update(post_rating=3, post_comments_rating=10)
+        Author.objects.filter(pk=self.commenter.pk).update(comment_rating=10)
+
+    def test_post_with_comments_is_deleted_within_budget(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('news_delete', args=[self.post.pk]))
+
+        self.assertRedirects(response, reverse('news_list'))
+        self.assertFalse(Comment.objects.exists())
+        self.author.refresh_from_db()
+        self.commenter.refresh_from_db()
+        self.assertEqual((self.author.post_rating, self.author.post_comments_rating), (0, 0))
+        self.assertEqual(self.commenter.comment_rating, 0)
+
+    def test_single_comment_delete_subtracts_its_rating(self):
+        self.post.comments.first().delete()
+        self.author.refresh_from_db()
+        self.commenter.refresh_from_db()
+        self.assertEqual((self.author.post_comments_rating, self.commenter.comment_rating), (9, 9))
+
+
+class NewsletterShardTests(TestCase):
+    def setUp(self):
+        self.run = NewsletterRun.objects.create(period_start=timezone.now() - timedelta(days=7), period_end=timezone.now())
+        self.shard = NewsletterShard.objects.create(run=self.run, first_user_id=1, last_user_id=10)
+
+    def test_failing_shard_is_marked_failed_and_run_finishes(self):
+        with mock.patch('news.tasks.send_weekly_digest', side_effect=smtplib.SMTPServerDisconnected) as send:
+            self.assertEqual(send_newsletter_shard.apply(args=[self.shard.pk]).get(), 0)
+        self.assertEqual(send.call_count, settings.NEWSLETTER_SHARD_MAX_ATTEMPTS)
+        self.shard.refresh_from_db()
+        self.assertEqual(self.shard.status, NewsletterShard.FAILED)
+
+        finish_newsletter_run(self.run.pk)
+        self.run.refresh_from_db()
+        self.assertIsNotNone(self.run.finished_at)
+
+    def test_refused_recipient_does_not_stop_batch(self):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'')}), 1]
+        messages = [EmailMessage(to=['bad@example.com']), EmailMessage(to=['good@example.com'])]
+        self.assertEqual(send_each(connection, messages), 1)
+
+        connection.send_messages.side_effect = smtplib.SMTPDataError(451, b'')
+        with self.assertRaises(smtplib.SMTPDataError):
+            send_each(connection, messages)
+
+    def test_stale_run_is_closed_and_new_run_started(self):
+        NewsletterRun.objects.filter(pk=self.run.pk).update(started_at=timezone.now() - timedelta(days=7))
+        with mock.patch('news.newsletter.dispatch_shards'):
+            run = start_newsletter_run()
+        self.assertNotEqual(run.pk, self.run.pk)
+        self.shard.refresh_from_db()
+        self.run.refresh_from_db()
+        self.assertEqual(self.shard.status, NewsletterShard.FAILED)
+        self.assertIsNotNone(self.run.finished_at)
+
+        with mock.patch('news.newsletter.dispatch_shards'):
+            self.assertEqual(start_newsletter_run().pk, run.pk)
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.peers = []
+        self.drop_next = False
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.drop_next:
+            # соединение рвётся посреди отправки письма
+            self.drop_next = False
+            server.transport.close()
+            return '421 Закрываю соединение'
+        self.peers.append(session.peer)
+        return '250 OK'
+
+
+class PooledEmailBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.handler = RecordingHandler()
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def backend(self, **kwargs):
+        backend = PooledEmailBackend(
+            host='127.0.0.1', port=self.port, use_ssl=False, use_tls=False, username='', password='', **kwargs,
+        )
+        self.addCleanup(lambda: _process_state()['pools'].pop(backend.pool_key, None))
+        return backend
+
+    def send(self, backend, count=1):
+        return backend.send_messages([EmailMessage('Тема', 'Текст', 'news@example.com', ['reader@example.com'])] * count)
+
+    def test_connection_is_reused_between_batches(self):
+        self.assertEqual(self.send(self.backend()), 1)
+        self.assertEqual(self.send(self.backend()), 1)
+        self.assertEqual(len(set(self.handler.peers)), 1)
+
+    def test_dropped_connection_is_reopened_and_message_resent(self):
+        backend = self.backend(retries=1)
+        self.send(backend)
+        self.handler.drop_next = True
+        self.assertEqual(self.send(backend), 1)
+        self.assertEqual(len(self.handler.peers), 2)
+        self.assertNotEqual(*self.handler.peers)
+
+    def test_rate_limit_spaces_messages(self):
+        started = time.monotonic()
+        self.assertEqual(self.send(self.backend(rate_limit=20, burst=1), count=4), 4)
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_only_temporary_errors_are_retried(self):
+        self.assertTrue(is_transient(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient(smtplib.SMTPDataError(451, b'')))
+        self.assertFalse(is_transient(smtplib.SMTPDataError(550, b'')))
+        self.assertFalse(is_transient(smtplib.SMTPRecipientsRefused({})))
+
+
+class ImportPostsTests(TestCase):
+    def setUp(self):
+        Author.objects.create(user=User.objects.create(username='author'))
+
+    def import_lines(self, lines, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as feed:
+            feed.write('\n'.join(lines))
+        self.addCleanup(os.remove, feed.name)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_posts', feed.name, '--no-notify', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def row(self, title, **fields):
+        return json.dumps({'title': title, 'content': 'Текст', 'author': 'author', **fields}, ensure_ascii=False)
+
+    def test_malformed_rows_are_skipped(self):
+        stdout, stderr = self.import_lines([
+            self.row('Первый', categories=['Политика']),
+            '{"title": ',
+            '[1, 2]',
+            self.row(1),
+            self.row('Пятый', categories={'name': 'Политика'}),
+            self.row('Шестой', categories='Политика'),
+        ])
+        self.assertEqual(set(Post.objects.values_list('title', flat=True)), {'Первый', 'Шестой'})
+        for number in (2, 3, 4, 5):
+            self.assertIn(f'Строка {number} пропущена', stderr)
+        self.assertIn('пропущено строк: 4', stdout)
+
+    def test_failed_batch_reports_resume_point(self):
+        lines = [self.row(f'Пост {number}') for number in range(1, 6)]
+        import_batch = Command.import_batch
+        calls = []
+
+        def fail_second_batch(command, posts, post_categories):
+            calls.append(len(posts))
+            if len(calls) == 2:
+                raise DatabaseError('база недоступна')
+            import_batch(command, posts, post_categories)
+
+        with mock.patch.object(Command, 'import_batch', fail_second_batch):
+            with self.assertRaisesMessage(CommandError, 'Закоммичено пачек: 1, постов: 2; продолжить: --start-row 3'):
+                self.import_lines(lines, '--batch-size', '2')
+
+        stdout, _ = self.import_lines(lines, '--batch-size', '2', '--start-row', '3')
+        self.assertIn('закоммичено пачек: 2', stdout)
+        self.assertEqual(Post.objects.count(), 5)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+
+    def search(self, query, **filters):
+        return set(NewsFilter({'title': query, **filters}, queryset=Post.objects.all()).qs.values_list('title', flat=True))
+
+    def test_index_follows_create_edit_and_delete(self):
+        post = Post.objects.create(author=self.author, title='Новости экономики', content='Курс рубля')
+        self.assertEqual(self.search('новостями'), {'Новости экономики'})
+        self.assertEqual(self.search('рубль'), {'Новости экономики'})
+
+        post.title = 'Итоги выборов'
+        post.save()
+        self.assertEqual(self.search('новости'), set())
+        self.assertEqual(self.search('выборы'), {'Итоги выборов'})
+
+        post.delete()
+        self.assertEqual(self.search('выборы'), set())
+
+    def test_bulk_created_posts_are_indexed(self):
+        Post.objects.bulk_create([
+            Post(author=self.author, title=f'Сводка {number}', content='Прогноз погоды') for number in range(3)
+        ])
+        self.assertEqual(len(self.search('погода')), 3)
+
+    def test_filters_apply_to_all_matches(self):
+        other = Author.objects.create(user=User.objects.create(username='other'))
+        Post.objects.create(author=self.author, title='Старые выборы', content='Текст')
+        Post.objects.bulk_create([Post(author=other, title=f'Выборы {number}', content='Текст') for number in range(20)])
+        self.assertEqual(self.search('выборы', author='author'), {'Старые выборы'})
+
+    def test_title_is_ranked_above_content(self):
+        Post.objects.create(author=self.author, title='Погода', content='Текст')
+        Post.objects.create(author=self.author, title='Сводка', content='Погода на завтра')
+        ranked = NewsFilter({'title': 'погода'}, queryset=Post.objects.all()).qs
+        self.assertEqual([post.title for post in ranked], ['Погода', 'Сводка'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DB_REPLICA_MAX_LAG=5)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        replicas._measured.clear()
+        self.addCleanup(replicas._measured.clear)
+        self.router = ReplicaRouter()
+        patcher = mock.patch('news.replicas.measure_lag', return_value=1.0)
+        self.measure_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_replica_until_first_write(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        with replica_reads() as alias:
+            self.assertEqual(alias, 'replica')
+            self.assertEqual(self.router.db_for_read(Post), 'replica')
+            self.assertEqual(self.router.db_for_write(Post), 'default')
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_replica_is_used_right_after_cache_invalidation(self):
+        # сброс тегов кэша не уводит чтения на основную базу: важна только позиция самой реплики
+        bump_tags('posts')
+        with replica_reads() as alias:
+            self.assertEqual(alias, 'replica')
+
+    def test_lagging_or_unavailable_replica_falls_back_to_primary(self):
+        self.measure_lag.return_value = 30.0
+        with replica_reads() as alias:
+            self.assertIsNone(alias)
+
+        replicas._measured.clear()
+        self.measure_lag.side_effect = DatabaseError
+        with replica_reads() as alias:
+            self.assertIsNone(alias)
+
+    def test_page_read_during_replica_lag_is_cached_briefly(self):
+        middleware = TaggedCacheMiddleware(lambda request: None, page_timeout=60, key_prefix=None)
+        request = RequestFactory().get('/news/')
+        request._replica_lag = 2.0
+        bump_tags('posts')
+        self.assertEqual(middleware.page_fresh_timeout(request, 0), 2.0)
+
+        shared_cache().set(LAST_BUMP_KEY, time.time() - 60, None)
+        self.assertEqual(middleware.page_fresh_timeout(request, 0), 60)
+
+    def test_write_pins_client_to_primary(self):
+        seen = []
+
+        def view(request):
+            with replica_reads():
+                seen.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(view)
+        self.assertIn(replicas.PIN_COOKIE, middleware(RequestFactory().post('/news/create/')).cookies)
+
+        pinned = RequestFactory().get('/news/')
+        pinned.COOKIES[replicas.PIN_COOKIE] = '1'
+        middleware(pinned)
+        self.assertNotIn(replicas.PIN_COOKIE, middleware(RequestFactory().get('/news/')).cookies)
+        self.assertEqual(seen, ['default', 'default', 'replica'])
+
+
+class ArchivePostsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.commenter = Author.objects.create(user=User.objects.create(username='commenter'))
+        self.category = Category.objects.create(name='Архив')
+        self.old = [
+            Post.objects.create(author=self.author, post_type=Post.NEWS, title=f'Старый {number}', content='Текст', rating=2)
+            for number in range(3)
+        ]
+        self.fresh = Post.objects.create(author=self.author, post_type=Post.NEWS, title='Новый', content='Текст', rating=5)
+        Post.objects.filter(pk__in=[post.pk for post in self.old]).update(timestamp=timezone.now() - timedelta(days=30))
+        for post in [*self.old, self.fresh]:
+            PostCategory.objects.create(post=post, category=self.category)
+            for number in range(2):
+                Comment.objects.create(post=post, user=self.commenter.user, text=f'Комментарий {number}', rating=1)
+        Author.objects.filter(pk=self.author.pk).update(post_rating=11, post_comments_rating=8)
+        Author.objects.filter(pk=self.commenter.pk).update(comment_rating=8)
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+
+    def read_archive(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_batch_is_archived_with_comments_and_categories(self):
+        path = os.path.join(self.archive_dir, 'posts.jsonl.gz')
+        with PostArchive(path) as archive:
+            self.assertEqual(archive_batch([post.pk for post in self.old], archive), (3, 6))
+
+        records = self.read_archive(path)
+        self.assertEqual([record['id'] for record in records], [post.pk for post in self.old])
+        self.assertEqual(records[0]['categories'], [self.category.pk])
+        self.assertEqual([comment['text'] for comment in records[0]['comments']], ['Комментарий 0', 'Комментарий 1'])
+
+    def test_comments_and_links_are_deleted_with_posts(self):
+        archive_batch([post.pk for post in self.old])
+
+        self.assertEqual(list(Post.objects.values_list('pk', flat=True)), [self.fresh.pk])
+        self.assertEqual(set(Comment.objects.values_list('post_id', flat=True)), {self.fresh.pk})
+        self.assertEqual(list(PostCategory.objects.values_list('post_id', flat=True)), [self.fresh.pk])
+
+    def test_archived_ratings_are_subtracted_from_authors(self):
+        archive_batch([post.pk for post in self.old])
+
+        self.author.refresh_from_db()
+        self.commenter.refresh_from_db()
+        self.assertEqual((self.author.post_rating, self.author.post_comments_rating), (5, 2))
+        self.assertEqual(self.commenter.comment_rating, 2)
+
+    def test_command_archives_only_expired_posts(self):
+        out = io.StringIO()
+        call_command('archive_posts', '--days', '7', '--batch-size', '2', '--sleep', '0',
+                     '--archive-dir', self.archive_dir, stdout=out)
+
+        self.assertIn('Архивировано постов: 3, комментариев: 6', out.getvalue())
+        self.assertEqual(list(Post.objects.values_list('pk', flat=True)), [self.fresh.pk])
+        [name] = os.listdir(self.archive_dir)
+        self.assertEqual(len(self.read_archive(os.path.join(self.archive_dir, name))), 3)
+
+
+class AuthorPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        Post.objects.bulk_create(
+            Post(author=self.author, post_type=Post.NEWS, title=f'Пост {number}', content='Текст') for number in range(12)
+        )
+
+    def test_posts_are_paginated_and_counted(self):
+        response = self.client.get(reverse('author_detail', args=[self.author.pk]))
+        self.assertEqual(response.context['post_count'], 12)
+        self.assertEqual(len(response.context['posts']), 10)
+
+        response = self.client.get(reverse('author_detail', args=[self.author.pk]), {'page': 2})
+        self.assertEqual(len(response.context['posts']), 2)
+
+
+class NotificationBenchmarkTests(TestCase):
+    # тот же путь, что меряет manage.py bench_notifications, но на небольшой базе и с locmem-почтой
+    def setUp(self):
+        self.post = seed(categories=2, subscribers=25, posts=1)[0]
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+
+    def dispatch(self):
+        with CaptureQueriesContext(connection) as queries:
+            batches = send_new_post_notification(self.post.pk)
+        return batches, len(queries)
+
+    @override_settings(NEWS_NOTIFICATION_BATCH_SIZE=10)
+    def test_dispatch_is_chunked_with_constant_queries_per_batch(self):
+        batches, queries = self.dispatch()
+
+        # seed подписывает каждого на две категории: писем по одному на подписчика, по 10 адресов в батче
+        self.assertEqual(batches, 3)
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(len({message.to[0] for message in mail.outbox}), 25)
+        # пост и id получателей, затем пост и пользователи на каждый батч - без запросов на каждое письмо
+        self.assertEqual(queries, 2 + 2 * batches)
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.category = Category.objects.create(name='Outbox')
+        self.category.subscribers.add(User.objects.create(username='reader', email='reader@example.com'))
+        self.posts = Post.objects.bulk_create(
+            Post(author=self.author, post_type=Post.NEWS, title=f'Пост {number}', content='Текст') for number in range(3)
+        )
+        for post in self.posts:
+            PostCategory.objects.create(post=post, category=self.category)
+        self.events = [outbox.record_post_created(post) for post in self.posts]
+
+    def relay(self, **kwargs):
+        with mock.patch('news.outbox.current_app') as app_mock:
+            relayed = outbox.relay_outbox(**kwargs)
+        return relayed, app_mock.tasks[outbox.EVENT_TASKS[OutboxEvent.POST_CREATED]].apply_async
+
+    def test_pending_events_are_claimed_in_batches(self):
+        relayed, apply_async = self.relay(batch_size=2)
+
+        self.assertEqual(relayed, 2)
+        self.assertEqual(
+            [call.kwargs['task_id'] for call in apply_async.call_args_list],
+            [event.idempotency_key for event in self.events[:2]],
+        )
+        self.assertEqual(
+            list(OutboxEvent.objects.filter(dispatched_at__isnull=False).values_list('pk', 'attempts')),
+            [(event.pk, 1) for event in self.events[:2]],
+        )
+        # отправленные недавно не отправляются повторно, следующий проход забирает оставшееся
+        self.assertEqual(self.relay()[0], 1)
+
+    def test_stale_dispatch_is_redelivered_and_processed_events_are_skipped(self):
+        stale = timezone.now() - timedelta(seconds=settings.OUTBOX_REDELIVERY_TIMEOUT + 1)
+        OutboxEvent.objects.filter(pk=self.events[0].pk).update(dispatched_at=stale, attempts=1)
+        OutboxEvent.objects.filter(pk=self.events[1].pk).update(dispatched_at=stale, processed_at=timezone.now())
+        OutboxEvent.objects.filter(pk=self.events[2].pk).update(dispatched_at=timezone.now())
+
+        relayed, apply_async = self.relay()
+
+        self.assertEqual(relayed, 1)
+        self.assertEqual(apply_async.call_args.kwargs['task_id'], self.events[0].idempotency_key)
+        self.assertEqual(OutboxEvent.objects.get(pk=self.events[0].pk).attempts, 2)
+
+    def test_broker_failure_leaves_the_rest_pending(self):
+        with mock.patch('news.outbox.current_app') as app_mock:
+            app_mock.tasks.__getitem__.return_value.apply_async.side_effect = [None, ConnectionError]
+            with self.assertLogs('news.outbox', 'ERROR'):
+                self.assertEqual(outbox.relay_outbox(), 1)
+
+        self.assertEqual(OutboxEvent.objects.filter(dispatched_at__isnull=True).count(), 2)
+
+    def test_repeated_delivery_is_processed_once(self):
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        event = self.events[0]
+
+        self.assertEqual(send_new_post_notification(self.posts[0].pk, event_key=event.idempotency_key), 1)
+        self.assertEqual(send_new_post_notification(self.posts[0].pk, event_key=event.idempotency_key), 0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        event.refresh_from_db()
+        self.assertIsNotNone(event.processed_at)
+
+    def test_old_processed_events_are_pruned(self):
+        OutboxEvent.objects.filter(pk=self.events[0].pk).update(
+            processed_at=timezone.now() - timedelta(days=settings.OUTBOX_RETENTION_DAYS + 1),
+        )
+        OutboxEvent.objects.filter(pk=self.events[1].pk).update(processed_at=timezone.now())
+
+        self.assertEqual(outbox.prune_outbox(batch_size=1), 1)
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('pk').values_list('pk', flat=True)),
+            [event.pk for event in self.events[1:]],
+        )
+
+
+class PostRecipientsTests(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(user=User.objects.create(username='author'))
+        self.categories = [Category.objects.create(name=f'Категория {number}') for number in range(3)]
+        self.post = Post.objects.create(author=self.author, post_type=Post.NEWS, title='Пост', content='Текст')
+        for category in self.categories[:2]:
+            PostCategory.objects.create(post=self.post, category=category)
+        self.readers = [User.objects.create(username=f'reader{number}', email=f'reader{number}@example.com') for number in range(5)]
+
+    def test_subscriber_of_several_sources_is_listed_once(self):
+        both = self.readers[0]
+        self.categories[0].subscribers.add(both, self.readers[1])
+        self.categories[1].subscribers.add(both)
+        self.author.subscribers.add(both, self.readers[2])
+        self.categories[2].subscribers.add(self.readers[3])
+        self.categories[0].subscribers.add(User.objects.create(username='no_email'))
+
+        self.assertEqual(list(get_post_recipients(self.post)), self.readers[:3])
+        self.assertEqual(list(get_posts_recipients([self.post.pk])), self.readers[:3])
+
+    @override_settings(NEWS_NOTIFICATION_BATCH_SIZE=2)
+    def test_recipients_are_fanned_out_in_batches(self):
+        self.categories[0].subscribers.add(*self.readers)
+        self.author.subscribers.add(*self.readers)
+
+        with mock.patch('news.tasks.group') as group:
+            self.assertEqual(send_new_post_notification(self.post.pk), 3)
+
+        batches = [signature.args for signature in group.call_args.args[0]]
+        readers = [reader.pk for reader in self.readers]
+        self.assertEqual(batches, [(self.post.pk, readers[:2]), (self.post.pk, readers[2:4]), (self.post.pk, readers[4:])])
+        group.return_value.apply_async.assert_called_once_with()
+
+
+class WeeklyDigestTests(TestCase):
+    def setUp(self):
+        author = Author.objects.create(user=User.objects.create(username='author'))
+        self.category = Category.objects.create(name='Дайджест')
+        self.readers = [User.objects.create(username=f'reader{number}', email=f'reader{number}@example.com') for number in range(5)]
+        self.category.subscribers.add(*self.readers)
+        self.posts = [self.create_post(author, f'Пост {number}') for number in range(2)]
+
+    def create_post(self, author, title):
+        post = Post.objects.create(author=author, post_type=Post.NEWS, title=title, content='Текст')
+        PostCategory.objects.create(post=post, category=self.category)
+        return post
+
+    def recipients(self):
+        return sorted(message.to[0] for message in mail.outbox)
+
+    @override_settings(NEWS_NOTIFICATION_BATCH_SIZE=2)
+    def test_rerun_after_partial_send_skips_delivered_readers(self):
+        calls = []
+
+        def fail_second_batch(connection, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise smtplib.SMTPServerDisconnected
+            return send_each(connection, messages)
+
+        with mock.patch('news.digest.send_each', side_effect=fail_second_batch):
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                send_weekly_digest()
+        self.assertEqual(self.recipients(), ['reader0@example.com', 'reader1@example.com'])
+
+        self.assertEqual(send_weekly_digest(), 3)
+        self.assertEqual(self.recipients(), sorted(reader.email for reader in self.readers))
+
+        # без новых постов повторный запуск никому не пишет, новый пост уходит всем и без старых
+        self.assertEqual(send_weekly_digest(), 0)
+        mail.outbox.clear()
+        new_post = self.create_post(self.posts[0].author, 'Свежий пост')
+        self.assertEqual(send_weekly_digest(), 5)
+        self.assertTrue(all(new_post.title in message.body and self.posts[0].title not in message.body for message in mail.outbox))
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author')
+        self.author = Author.objects.create(user=self.user)
+        self.category = Category.objects.create(name='Политика')
+        self.post = Post.objects.create(author=self.author, title='Пост', content='Текст')
+        self.post.category.add(self.category)
+
+    def test_category_rename_refreshes_post_page(self):
+        url = f'/news/{self.post.pk}'
+        self.assertContains(self.client.get(url), 'Политика')
+
+        self.category.name = 'Экономика'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertContains(self.client.get(url), 'Экономика')
+
+    def test_post_validator_is_cached_and_follows_category_names(self):
+        url = f'/news/{self.post.pk}'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.category.name = 'Экономика'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_post_rows_follow_author_and_category_names(self):
+        self.assertContains(self.client.get('/news/'), 'Политика')
+
+        self.category.name = 'Экономика'
+        self.user.username = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+            self.user.save()
+        response = self.client.get('/news/')
+        self.assertContains(response, 'Экономика')
+        self.assertContains(response, 'renamed')
+
+    def test_waiters_stop_when_lock_is_released_without_page(self):
+        # страницу 404 считавший не сохраняет: ожидающий не должен ждать её весь wait_timeout
+        middleware = TaggedCacheMiddleware(lambda request: None, page_timeout=60, key_prefix=None)
+        lock_key = middleware.lock_key(RequestFactory().get('/news/0'))
+        cache.add(lock_key, 1)
+        threading.Timer(0.1, cache.delete, [lock_key]).start()
+
+        started = time.monotonic()
+        self.assertEqual(self.client.get('/news/0').status_code, 404)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_pages_of_logged_in_users_are_not_cached(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get('/news/'), 'author')
+        self.client.logout()
+        self.assertNotContains(self.client.get('/news/'), 'Выйти')
@@ -1,36 +1,71 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib.auth.mixins import PermissionRequiredMixin, LoginRequiredMixin
+from django.conf import settings
 from django.core.cache import cache
-from django.core.mail import get_connection, EmailMultiAlternatives
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Exists, OuterRef, prefetch_related_objects
 from django.http import HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views import View
-from django.views.decorators.cache import cache_page
 from django.views.generic import ListView, DetailView, UpdateView, DeleteView
 
+from .caching import add_cache_tags, related_tags, tag_posts, tagged_cache_page
+from .conditional import category_validators, conditional_page, post_list_validators, post_validators
 from .filters import NewsFilter
 from .forms import NewsForm, ArticleForm, NewsEditForm, ArticlesEditForm
-from .models import Post, Author, Category
-from django.conf import settings
+from .models import Post, Author, Category, PostCategory
+from .pagination import KeysetPaginationMixin
+from .query_budget import QueryPlanMixin
+from .replicas import ReplicaReadMixin
+from .ratelimit import SlidingWindowLimit
 import logging
 
 logger = logging.getLogger(__name__)
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class NewsListView(ListView):
+
+def author_post_times(author_id, since):
+    return Post.objects.filter(author_id=author_id, timestamp__gte=since).values_list('timestamp', flat=True)
+
+
+def lock_author(author_id):
+    # пока лимит публикаций считается по базе, одновременные публикации автора идут по очереди
+    list(Author.objects.select_for_update().filter(pk=author_id).values_list('pk', flat=True))
+
+
+post_limit = SlidingWindowLimit(
+    'posts', settings.POST_DAILY_LIMIT, window=60 * 60 * 24, bucket=60 * 60, seed=author_post_times,
+    lock=lock_author,
+)
+subscription_limit = SlidingWindowLimit('subscriptions', settings.SUBSCRIPTION_RATE_LIMIT, window=60, bucket=5)
+
+
+def is_subscribed(user, obj):
+    # один EXISTS вместо загрузки всех подписчиков в шаблоне
+    if obj is None or not user.is_authenticated:
+        return False
+    return obj.subscribers.filter(pk=user.pk).exists()
+
+
+@method_decorator(conditional_page(post_list_validators), name='dispatch')
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class NewsListView(ReplicaReadMixin, KeysetPaginationMixin, QueryPlanMixin, ListView):
     model = Post
     ordering = ['-timestamp']
     template_name = 'news/news.html'
     context_object_name = 'posts'
     paginate_by = 5
+    select_related = ['author__user']
+    prefetch_related = ['category']
+    query_budget = 8
 
     def get_queryset(self):
+        add_cache_tags(self.request, 'posts')
         queryset = super().get_queryset()
         self.filterset = NewsFilter(self.request.GET, queryset)
 
@@ -38,39 +73,59 @@ class NewsListView(ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        tag_posts(self.request, context['posts'])
         context['time_now'] = datetime.now(timezone.utc)
         context['next_sale'] = None
         return context
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class NewsDetailView(DetailView):
+@method_decorator(conditional_page(post_validators), name='dispatch')
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class NewsDetailView(QueryPlanMixin, DetailView):
     model = Post
     context_object_name = 'post'
     template_name = 'news/new.html'
+    query_budget = 6
 
     def get_object(self, *args, **kwargs):
         pk = self.kwargs['pk']
+        add_cache_tags(self.request, f'post-{pk}')
         post = cache.get(f'post-{pk}')
         if not post:
-            post = super().get_object(queryset=self.queryset)
+            post = super().get_object()
             cache.set(f'post-{pk}', post)
+        # категории не хранятся в кэше вместе с постом: переименование категории не сбрасывает запись post-<pk>
+        prefetch_related_objects([post], 'category')
+        add_cache_tags(self.request, *related_tags(post))
         return post
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class NewsSearchView(ListView):
+@method_decorator(conditional_page(post_list_validators), name='dispatch')
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class NewsSearchView(ReplicaReadMixin, KeysetPaginationMixin, QueryPlanMixin, ListView):
     model = Post
     ordering = ['-timestamp']
     template_name = 'news/news_search.html'
     context_object_name = 'posts'
     paginate_by = 5
+    select_related = ['author__user']
+    prefetch_related = ['category']
+    query_budget = 8
 
     def get_queryset(self):
+        add_cache_tags(self.request, 'posts')
         queryset = super().get_queryset()
         self.filterset = NewsFilter(self.request.GET, queryset=queryset)
+        if self.filterset.search_query:
+            # бэкенд поиска уже упорядочил результаты по релевантности
+            return self.filterset.qs
         return self.filterset.qs.order_by('-timestamp')
 
+    def use_keyset(self):
+        # курсор построен по дате, а результаты поиска идут по релевантности - для них обычные страницы
+        return not self.filterset.search_query and super().use_keyset()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        tag_posts(self.request, context['posts'])
         context['filterset'] = self.filterset
         return context
 
@@ -81,6 +136,7 @@ class NewsEditView(PermissionRequiredMixin, UpdateView):
     model = Post
     template_name = 'news/news_edit.html'
     context_object_name = 'post'
+    query_budget = 16
 
     def get_success_url(self):
         return reverse('post_detail', kwargs={'pk': self.object.pk})
@@ -93,6 +149,7 @@ class NewsDeleteView(PermissionRequiredMixin, DeleteView):
     permission_required = 'news.delete_post'
     model = Post
     template_name = 'news/news_delete.html'
+    query_budget = 15
 
     def get_queryset(self):
         return Post.objects.filter(post_type=Post.NEWS, author__user=self.request.user)
@@ -107,6 +164,7 @@ class ArticlesEditView(PermissionRequiredMixin, UpdateView):
     model = Post
     template_name = 'news/articles_edit.html'
     context_object_name = 'post'
+    query_budget = 16
 
     def get_success_url(self):
         return reverse('post_detail', kwargs={'pk': self.object.pk})
@@ -119,6 +177,7 @@ class ArticlesDeleteView(PermissionRequiredMixin, DeleteView):
     permission_required = 'news.delete_post'
     model = Post
     template_name = 'news/articles_delete.html'
+    query_budget = 15
 
     def get_queryset(self):
         return Post.objects.filter(post_type=Post.ARTICLE, author__user=self.request.user)
@@ -131,6 +190,9 @@ class ArticlesDeleteView(PermissionRequiredMixin, DeleteView):
 @method_decorator(permission_required('news.add_post', raise_exception=True), name='dispatch')
 class CreatePostView(View):
     template_name = 'news/create_post.html'
+    # создание поста: транзакция, outbox, категории и touch_posts; лимит читает базу при первом обращении,
+    # а без Redis - на каждом запросе (блокировка строки автора и COUNT)
+    query_budget = 16
 
     def is_author(self):
         return self.request.user.groups.filter(name='authors').exists()
@@ -138,13 +200,10 @@ class CreatePostView(View):
     def get(self, request):
         post_type = request.GET.get('type')
         author = Author.objects.filter(user=request.user).first()
-        posts_last_24h = 0
-        if author:
-            from django.utils.timezone import now
-            since = now() - timedelta(days=1)
-            posts_last_24h = Post.objects.filter(author=author, timestamp__gte=since).count()
+        # счётчик публикаций берётся из кэша, база читается только при первом обращении
+        posts_last_24h = post_limit.count(author.pk) if author else 0
 
-        can_create = posts_last_24h < 3
+        can_create = posts_last_24h < post_limit.limit
 
         if post_type == 'news':
             form = NewsForm()
@@ -158,25 +217,16 @@ class CreatePostView(View):
             'post_type': post_type,
             'can_create': can_create,
             'posts_last_24h': posts_last_24h,
+            'post_limit': post_limit.limit,
         })
 
     def post(self, request):
         post_type = request.POST.get('post_type')
         author = Author.objects.filter(user=request.user).first()
-        from django.utils.timezone import now
-        from datetime import timedelta
 
         if not author:
             return HttpResponse("Вы не зарегистрированы как автор.", status=403)
 
-        since = now() - timedelta(days=1)
-        posts_last_24h = Post.objects.filter(author=author, timestamp__gte=since).count()
-
-        if posts_last_24h >= 3:
-            from django.contrib import messages
-            messages.error(request, 'Вы не можете публиковать более 3 новостей в сутки.')
-            return redirect(f"{reverse('news_create')}?type={post_type}")
-
         if post_type == 'news':
             form = NewsForm(request.POST)
         elif post_type == 'article':
@@ -184,104 +234,104 @@ class CreatePostView(View):
         else:
             form = None
 
-        if form and form.is_valid():
-            post = form.save(commit=False)
-            post.author = author
-            post.save()
-            form.save_m2m()
-
-            try:
-                categories = list(post.category.all())
-            except Exception:
-                try:
-                    categories = [pc.category for pc in post.post_categories.all()]
-                except Exception:
-                    categories = []
-
-            subscribers_dict = {}
-            for cat in categories:
-                for u in cat.subscribers.all():
-                    if u.email:
-                        subscribers_dict[u.id] = u
-            subscribers = list(subscribers_dict.values())
-
-            if subscribers:
-                subject = post.title
-                from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', settings.EMAIL_HOST_USER)
-                connection = get_connection(fail_silently=False)
-                messages = []
-
-                for user in subscribers:
-                    post_url = request.build_absolute_uri(reverse('post_detail', kwargs={'pk': post.pk}))
-                    html_content = render_to_string('news/post_notification.html', {
-                        'post': post,
-                        'post_url': post_url,
-                        'username': user.username,
-                    })
-
-                    text = f'Здравствуй, {user.username}. Новая статья в твоём любимом разделе!\n{post.content[:50]}'
-
-                    msg = EmailMultiAlternatives(
-                        subject=subject,
-                        body=text,
-                        from_email=from_email,
-                        to=[user.email],
-                        connection=connection,
-                    )
-                    msg.attach_alternative(html_content, "text/html")
-                    messages.append(msg)
-
-                try:
-                    connection.send_messages(messages)
-                except Exception as e:
-                    logger.exception("Ошибка при отправке рассылки о посте %s: %s", post.pk, e)
-
-            return redirect(reverse('post_detail', kwargs={'pk': post.pk}))
-
-        return render(request, self.template_name, {'form': form, 'post_type': post_type})
-
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class CategoryDetailView(ListView):
+        if not (form and form.is_valid()):
+            return render(request, self.template_name, {'form': form, 'post_type': post_type})
+
+        bucket = None
+        try:
+            # пост и его категории сохраняются одной транзакцией, рассылка уходит после коммита.
+            # Место в лимите занимается в той же транзакции: два одновременных запроса не пройдут оба
+            with transaction.atomic():
+                bucket = post_limit.acquire(author.pk)
+                if bucket is None:
+                    messages.error(request, f'Вы не можете публиковать более {post_limit.limit} новостей в сутки.')
+                    return redirect(f"{reverse('news_create')}?type={post_type}")
+                post = form.save(commit=False)
+                post.author = author
+                post.save()
+                form.save_m2m()
+        except Exception:
+            if bucket is not None:
+                post_limit.release(author.pk, bucket)
+            raise
+
+        return redirect(reverse('post_detail', kwargs={'pk': post.pk}))
+
+@method_decorator(conditional_page(category_validators), name='dispatch')
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class CategoryDetailView(ReplicaReadMixin, KeysetPaginationMixin, QueryPlanMixin, ListView):
     model = Post
     template_name = 'news/category_posts.html'
     context_object_name = 'posts'
     paginate_by = 5
     ordering = ['-timestamp']
+    select_related = ['author__user']
+    prefetch_related = ['category']
+    query_budget = 10
 
     def get_queryset(self):
         category_id = self.kwargs.get('category_id')
+        add_cache_tags(self.request, f'category-{category_id}')
         self.category = get_object_or_404(Category, id=category_id)
-        return Post.objects.filter(category__id=category_id).order_by('-timestamp')
+        # лента идёт по индексу (timestamp, id) с проверкой принадлежности к категории,
+        # а не сортирует все посты категории ради одной страницы
+        in_category = PostCategory.objects.filter(post=OuterRef('pk'), category_id=category_id)
+        return super().get_queryset().filter(Exists(in_category))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        tag_posts(self.request, context['posts'])
         context['category'] = getattr(self, 'category', None)
+        context['is_subscribed'] = is_subscribed(self.request.user, context['category'])
         return context
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
 class CategoryListView(ListView):
     model = Category
     template_name = 'news/categories.html'
     context_object_name = 'categories'
+    query_budget = 4
+
+    def get_queryset(self):
+        add_cache_tags(self.request, 'categories')
+        return super().get_queryset()
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class AuthorListView(ListView):
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class AuthorListView(QueryPlanMixin, ListView):
     model = Author
     template_name = 'news/authors.html'
     context_object_name = 'authors'
+    select_related = ['user']
+    query_budget = 4
+
+    def get_queryset(self):
+        add_cache_tags(self.request, 'authors')
+        return super().get_queryset()
 
-@method_decorator(cache_page(60 * 5), name='dispatch')
-class AuthorDetailView(DetailView):
+@method_decorator(tagged_cache_page(settings.CACHE_PAGE_TIMEOUT), name='dispatch')
+class AuthorDetailView(ReplicaReadMixin, QueryPlanMixin, DetailView):
     model = Author
     template_name = 'news/author_page.html'
     context_object_name = 'author_page'
+    select_related = ['user']
+    paginate_by = 10
+    query_budget = 7
+
+    def get_object(self, queryset=None):
+        add_cache_tags(self.request, f"author-{self.kwargs['pk']}")
+        return super().get_object(queryset)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        posts = Post.objects.filter(author=self.object).order_by('-timestamp')
-        context['posts'] = posts
-        context['post_count'] = posts.count()
-        context['author_rating'] = self.object.rating
+        # на странице автора только одна страница его постов; общее число считает COUNT(*) пагинатора
+        paginator = Paginator(Post.objects.filter(author=self.object).order_by('-timestamp', '-pk'), self.paginate_by)
+        page_obj = paginator.get_page(self.request.GET.get('page'))
+        context['paginator'] = paginator
+        context['page_obj'] = page_obj
+        context['posts'] = page_obj.object_list
+        context['post_count'] = paginator.count
+        context['author_rating'] = self.object.current_rating
+        context['is_subscribed'] = is_subscribed(self.request.user, self.object)
 
         return context
 
@@ -292,11 +342,19 @@ class SubscriptionView(LoginRequiredMixin, View):
         'author': Author,
     }
     template_name = 'news/subscribe.html'
+    query_budget = 9
 
     def post(self, request, model_type, object_id, action):
         obj = self.get_object(model_type, object_id)
         if not obj:
             return redirect('profile')
+        # неизвестное действие не должно тратить лимит
+        if action not in ('subscribe', 'unsubscribe'):
+            return redirect(self.get_redirect_url(model_type, object_id))
+
+        if subscription_limit.acquire(request.user.pk) is None:
+            messages.error(request, 'Слишком много подписок и отписок подряд, попробуйте через минуту.')
+            return redirect(self.get_redirect_url(model_type, object_id))
 
         if action == 'subscribe':
             obj.subscribers.add(request.user)
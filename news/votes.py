@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+
+from .cache_backends import has_atomic_counters, shared_cache
+from .caching import bump_tags
+from .models import POST_RATING_WEIGHT, Author, Comment, Post
+
+# вид счётчика -> модель и поле, к которому прибавляется накопленная разница
+TARGETS = {
+    'post': (Post, 'rating'),
+    'comment': (Comment, 'rating'),
+    'author-post': (Author, 'post_rating'),
+    'author-comment': (Author, 'comment_rating'),
+    'author-post-comments': (Author, 'post_comments_rating'),
+}
+AUTHOR_WEIGHTS = {'post_rating': POST_RATING_WEIGHT, 'comment_rating': 1, 'post_comments_rating': 1}
+
+JOURNAL_SEQ_KEY = 'votes:journal-seq'
+JOURNAL_FLUSHED_KEY = 'votes:journal-flushed'
+JOURNAL_SEEN_KEY = 'votes:journal-seen'
+FLUSH_LOCK_KEY = 'votes:flush-lock'
+
+
+def delta_key(kind, pk):
+    return f'votes:delta:{kind}:{pk}'
+
+
+def dirty_key(kind, pk):
+    return f'votes:dirty:{kind}:{pk}'
+
+
+def journal_key(position):
+    return f'votes:journal:{position}'
+
+
+def increment(cache, key, delta):
+    cache.add(key, 0, None)
+    return cache.incr(key, delta)
+
+
+def record_votes(deltas):
+    """
+    Голос не пишется в базу: разница атомарно прибавляется к счётчику в кэше, а flush_votes раз в
+    несколько секунд переносит все накопленные счётчики в базу пачкой UPDATE.
+    Объект попадает в журнал один раз до следующего сброса, сколько бы голосов он ни получил.
+    Без общего кэша с атомарными счётчиками голос сразу пишется в базу: буфер, накопленный
+    в одном процессе, flush_votes из другого процесса не увидел бы.
+    """
+    cache = shared_cache()
+    if not has_atomic_counters(cache):
+        write_deltas({(kind, pk): delta for (kind, pk), delta in deltas.items() if delta and pk is not None})
+        return
+    for (kind, pk), delta in deltas.items():
+        if not delta or pk is None:
+            continue
+        increment(cache, delta_key(kind, pk), delta)
+        if cache.add(dirty_key(kind, pk), 1, settings.VOTE_DIRTY_TIMEOUT):
+            position = increment(cache, JOURNAL_SEQ_KEY, 1)
+            cache.set(journal_key(position), (kind, pk), settings.VOTE_JOURNAL_TIMEOUT)
+
+
+def record_post_vote(post, delta):
+    record_votes({('post', post.pk): delta, ('author-post', post.author_id): delta})
+
+
+def record_comment_vote(comment, post_author_id, delta):
+    # комментарий входит в рейтинг своего автора и в рейтинг автора поста
+    record_votes({
+        ('comment', comment.pk): delta,
+        ('author-comment', comment.user_id): delta,
+        ('author-post-comments', post_author_id): delta,
+    })
+
+
+def pending_votes(kind, pks):
+    if not has_atomic_counters(shared_cache()):
+        return {}
+    keys = {delta_key(kind, pk): pk for pk in pks}
+    return {keys[key]: delta for key, delta in shared_cache().get_many(list(keys)).items() if delta}
+
+
+def pending_author_rating(pk):
+    return sum(
+        pending_votes(kind, [pk]).get(pk, 0) * AUTHOR_WEIGHTS[TARGETS[kind][1]]
+        for kind in ('author-post', 'author-comment', 'author-post-comments')
+    )
+
+
+def take_deltas(cache, entries):
+    # сначала снимается отметка в журнале: голос, пришедший после чтения счётчика, запишет объект в журнал заново
+    cache.delete_many([dirty_key(kind, pk) for kind, pk in entries])
+    values = cache.get_many([delta_key(kind, pk) for kind, pk in entries])
+    taken = {}
+    for kind, pk in entries:
+        value = values.get(delta_key(kind, pk))
+        if value:
+            # decr, а не delete: голоса, добавленные после чтения, остаются в счётчике
+            cache.decr(delta_key(kind, pk), value)
+            taken[(kind, pk)] = value
+    return taken
+
+
+def delta_case(deltas):
+    return Case(
+        *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+        default=Value(0),
+        output_field=FloatField(),
+    )
+
+
+def write_deltas(taken):
+    updates = defaultdict(lambda: defaultdict(dict))
+    for (kind, pk), delta in taken.items():
+        model, field = TARGETS[kind]
+        updates[model][field][pk] = delta
+
+    with transaction.atomic():
+        for model, fields in updates.items():
+            values = {field: F(field) + delta_case(deltas) for field, deltas in fields.items()}
+            if model is Author:
+                totals = defaultdict(int)
+                for field, deltas in fields.items():
+                    for pk, delta in deltas.items():
+                        totals[pk] += delta * AUTHOR_WEIGHTS[field]
+                values['rating'] = F('rating') + delta_case(totals)
+            pks = set().union(*fields.values())
+            model.objects.filter(pk__in=pks).update(**values)
+
+        authors = set().union(*updates[Author].values()) if Author in updates else set()
+        if authors:
+            transaction.on_commit(lambda: bump_tags(*[f'author-{pk}' for pk in authors]))
+
+
+def flush_votes(batch_size=None):
+    batch_size = batch_size or settings.VOTE_FLUSH_BATCH_SIZE
+    cache = shared_cache()
+    if not has_atomic_counters(cache):
+        return 0
+    if not cache.add(FLUSH_LOCK_KEY, 1, settings.VOTE_FLUSH_LOCK_TIMEOUT):
+        return 0
+
+    try:
+        flushed = cache.get(JOURNAL_FLUSHED_KEY, 0)
+        seen = cache.get(JOURNAL_SEEN_KEY, 0)
+        last = cache.get(JOURNAL_SEQ_KEY, 0)
+        watermark = None
+        written = 0
+        for start in range(flushed + 1, last + 1, batch_size):
+            positions = range(start, min(start + batch_size, last + 1))
+            found = cache.get_many([journal_key(position) for position in positions])
+            for position in positions:
+                # позиция выдана, но запись ещё не сделана: следующий сброс перечитает журнал с неё.
+                # Дыра, оставшаяся с прошлого сброса, пропускается, объект вернётся в журнал по истечении отметки
+                if journal_key(position) not in found and position > seen and watermark is None:
+                    watermark = position - 1
+
+            # объект, снова попавший в журнал после прошлого сброса, встречается дважды - счётчик снимается один раз
+            taken = take_deltas(cache, list(dict.fromkeys(found.values())))
+            try:
+                write_deltas(taken)
+            except Exception:
+                # снятые со счётчиков голоса возвращаются, чтобы их записал следующий сброс
+                record_votes(taken)
+                raise
+            written += len(taken)
+
+            done = [position for position in positions if watermark is None or position <= watermark]
+            cache.delete_many([journal_key(position) for position in done])
+
+        cache.set(JOURNAL_FLUSHED_KEY, last if watermark is None else watermark, None)
+        cache.set(JOURNAL_SEEN_KEY, last, None)
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+    return written
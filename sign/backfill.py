@@ -0,0 +1,32 @@
+from django.db import transaction
+
+
+def backfill(queryset, model, build, batch_size=1000, after=0, dry_run=False, on_batch=None):
+    """
+    Пакетное дозаполнение таблицы model: строки queryset читаются пачками по возрастанию pk
+    (без OFFSET), build(obj) строит по строке новый объект model или возвращает None,
+    пачка вставляется одним bulk_create в своей короткой транзакции.
+    queryset сам отсекает уже обработанные строки (anti-join через ~Exists), поэтому прерванный
+    запуск достаточно повторить; after - pk, с которого продолжить, не перечитывая начало таблицы.
+    on_batch(last_pk, created) вызывается после каждой пачки. Возвращает число созданных объектов
+    (при dry_run - сколько было бы создано).
+    """
+    created = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=after).order_by('pk')[:batch_size])
+        if not rows:
+            return created
+        objs = [obj for obj in map(build, rows) if obj is not None]
+        if objs and not dry_run:
+            batch = queryset.filter(pk__gte=rows[0].pk, pk__lte=rows[-1].pk)
+            with transaction.atomic():
+                # строку мог дозаполнить параллельный запуск или сам allauth при входе пользователя - такой объект
+                # bulk_create молча пропускает, поэтому созданными считаются строки, которые пачка вывела из anti-join
+                missing = batch.count()
+                model.objects.bulk_create(objs, ignore_conflicts=True)
+                created += missing - batch.count()
+        else:
+            created += len(objs)
+        after = rows[-1].pk
+        if on_batch is not None:
+            on_batch(after, created)
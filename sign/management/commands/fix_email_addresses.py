@@ -1,22 +1,50 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 from allauth.account.models import EmailAddress
 
+from sign.backfill import backfill
+
 User = get_user_model()
 
 
 class Command(BaseCommand):
     help = "Создаёт EmailAddress для старых пользователей без подтверждения"
 
-    def handle(self, *args, **kwargs):
-        count = 0
-        for user in User.objects.all():
-            if user.email and not EmailAddress.objects.filter(user=user).exists():
-                EmailAddress.objects.create(
-                    user=user,
-                    email=user.email,
-                    verified=False,
-                    primary=True
-                )
-                count += 1
-        self.stdout.write(self.style.SUCCESS(f"Создано записей: {count}"))
+    # python manage.py fix_email_addresses --batch-size 5000 --after 120000
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Пользователей в одной пачке')
+        parser.add_argument('--after', type=int, default=0, help='Продолжить с пользователя после указанного id')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не создавать')
+
+    def handle(self, *args, **options):
+        # пользователи без единого адреса allauth - одним anti-join, без запроса на каждого
+        users = (
+            User.objects
+            .exclude(email='')
+            .filter(~Exists(EmailAddress.objects.filter(user=OuterRef('pk'))))
+            .only('pk', 'email')
+        )
+        started = time.monotonic()
+
+        def progress(last_pk, created):
+            self.stdout.write(
+                f"Обработано до id {last_pk}, создано записей: {created}, "
+                f"{created / (time.monotonic() - started):.0f} в секунду"
+            )
+
+        count = backfill(
+            users,
+            EmailAddress,
+            lambda user: EmailAddress(user=user, email=user.email, verified=False, primary=True),
+            batch_size=options['batch_size'],
+            after=options['after'],
+            dry_run=options['dry_run'],
+            on_batch=progress,
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f"Пробный запуск, будет создано записей: {count}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Создано записей: {count}"))
@@ -1 +1,51 @@
-# Create your tests here.
+import io
+
+from allauth.account.models import EmailAddress
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import Exists, OuterRef
+from django.test import TestCase
+
+from sign.backfill import backfill
+
+
+class FixEmailAddressesTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{number}', email=f'user{number}@example.com') for number in range(5)]
+        EmailAddress.objects.create(user=self.users[1], email=self.users[1].email, primary=True)
+        User.objects.create(username='no_email')
+
+    def fix(self, *args):
+        out = io.StringIO()
+        call_command('fix_email_addresses', '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def without_address(self):
+        return User.objects.exclude(email='').filter(~Exists(EmailAddress.objects.filter(user=OuterRef('pk'))))
+
+    def test_only_users_without_address_are_filled(self):
+        self.assertIn('Создано записей: 4', self.fix())
+        self.assertFalse(self.without_address().exists())
+        self.assertEqual(EmailAddress.objects.filter(user=self.users[1]).count(), 1)
+        self.assertFalse(EmailAddress.objects.filter(user__username='no_email').exists())
+
+    def test_dry_run_creates_nothing(self):
+        self.assertIn('будет создано записей: 4', self.fix('--dry-run'))
+        self.assertEqual(EmailAddress.objects.count(), 1)
+
+    def test_resume_after_id_and_rerun(self):
+        self.assertIn('Создано записей: 2', self.fix('--after', str(self.users[2].pk)))
+        self.assertEqual(list(self.without_address()), self.users[:1] + self.users[2:3])
+
+        self.assertIn('Создано записей: 2', self.fix())
+        self.assertIn('Создано записей: 0', self.fix())
+
+    def test_rows_filled_concurrently_are_not_counted(self):
+        def build(user):
+            # адрес появляется между чтением пачки и вставкой, как при входе пользователя через allauth
+            if user == self.users[0]:
+                EmailAddress.objects.create(user=user, email=user.email, primary=True)
+            return EmailAddress(user=user, email=user.email, primary=True)
+
+        self.assertEqual(backfill(self.without_address(), EmailAddress, build, batch_size=2), 3)
+        self.assertEqual(EmailAddress.objects.count(), 5)
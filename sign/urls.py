@@ -1,11 +1,11 @@
-from django.contrib.auth.views import LogoutView, LoginView
+from django.contrib.auth.views import LogoutView
 from django.urls import path, include
 
-from .views import SignUpView, ProfileView, become_author, profile_view
+from .views import SignUpView, CustomLoginView, ProfileView, become_author, profile_view
 
 urlpatterns = [
     path('', include('allauth.urls')),
-    path('login/', LoginView.as_view(template_name='sign/login.html'), name='login'),
+    path('login/', CustomLoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('signup/', SignUpView.as_view(template_name='sign/signup.html'), name='signup'),
     path('profile/', ProfileView.as_view(), name='profile'),
@@ -12,6 +12,7 @@ from django.views.generic import TemplateView
 from django.views.generic.edit import CreateView
 
 from news.models import Author, Post
+from news.query_budget import query_budget
 from .forms import BaseRegisterForm
 
 
@@ -19,6 +20,7 @@ class SignUpView(CreateView):
     form_class = BaseRegisterForm
     template_name = 'sign/signup.html'
     success_url = reverse_lazy('login')
+    query_budget = 15
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -30,10 +32,12 @@ class SignUpView(CreateView):
 
 class CustomLoginView(LoginView):
     template_name = 'sign/login.html'
+    query_budget = 8
 
 
 class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = 'sign/profile.html'
+    query_budget = 9
 
     def get(self, request, *args, **kwargs):
         editing_profile = request.GET.get('editing') == '1'
@@ -58,7 +62,7 @@ class ProfileView(LoginRequiredMixin, TemplateView):
 
         context['is_author'] = user.groups.filter(name='authors').exists()
 
-        posts_qs = Post.objects.filter(author__user=user).select_related('author').order_by('-timestamp')
+        posts_qs = Post.objects.filter(author__user=user).select_related('author__user').order_by('-timestamp')
 
         paginator = Paginator(posts_qs, 10)
         page_number = self.request.GET.get('page')
@@ -67,7 +71,7 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         context.update({
             'page_obj': page_obj,
             'posts': page_obj.object_list,
-            'total_posts': posts_qs.count(),
+            'total_posts': paginator.count,
         })
 
         context['editing_profile'] = kwargs.get('editing_profile', False)
@@ -75,6 +79,7 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         return context
 
 
+@query_budget(10)
 @login_required
 @require_POST
 def become_author(request):
@@ -89,6 +94,7 @@ def become_author(request):
     return redirect('profile')
 
 
+@query_budget(8)
 @login_required
 def profile_view(request):
     if request.method == 'POST':